@@ -3,13 +3,122 @@ http://code.activestate.com/recipes/413838-memento-closure/
 
 *要約
 オブジェクトを以前の状態に復元する機能を提供する。
+
+Trackedを継承したオブジェクトでは、memento()は__dict__全体をコピーせず、
+それ以降に書き換えられた属性の元の値だけを記録する。
+
+FastTransactionalは、アクセスのたびにラッパーを作らず、
+Trackedのオブジェクトでは呼び出し前のスナップショットを取らずに済ませる。
+
+Historyは複数段階のundo/redoを提供する。最新以外のスナップショットは
+pickleでシリアライズして保持し、合計の大きさが上限を超えると古いものから捨てる。
 """
 
-from typing import Callable, List
+import pickle
+import weakref
+import zlib
 from copy import copy, deepcopy
+from functools import partial
+from types import MethodType
+from typing import Callable, Dict, List
+
+# 記録した時点では存在しなかった属性を表す
+_MISSING = object()
+
+# Trackedのオブジェクトのid → 書き込みの記録(_WriteLogへの弱参照)のリスト
+# インスタンスの__dict__の外に置くので、pickleやcopyの対象にならない
+_write_logs: Dict[int, list] = {}
+
+
+class _WriteLog(dict):
+    """memento()の時点から書き換えられた属性の、元の値を記録する"""
+
+    def __init__(self, deep):
+        super().__init__()
+        self.deep = deep
+
+
+class Tracked:
+    """
+    属性への書き込みを記録し、memento()を軽くするミックスイン
+
+    属性を最初に書き換える（または削除する）ときに、その時点の値だけを
+    記録するので、スナップショットとロールバックは変更された属性の数だけで済む。
+    リストへのappendのようなオブジェクト内部の変更は記録されないので、
+    そのような属性は代入し直すこと。
+    """
+
+    def __setattr__(self, name, value):
+        self._record_write(name)
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        self._record_write(name)
+        object.__delattr__(self, name)
+
+    def _record_write(self, name):
+        refs = _write_logs.get(id(self))
+        if not refs:
+            return
+        expired = False
+        for ref in refs:
+            log = ref()
+            if log is None:
+                expired = True
+            elif name not in log:
+                value = self.__dict__.get(name, _MISSING)
+                log[name] = deepcopy(value) if log.deep else value
+        if expired:
+            # restore()が参照されなくなったmementoの記録を取り除く
+            refs[:] = [ref for ref in refs if ref() is not None]
+
+
+def _logs_of(obj):
+    key = id(obj)
+    refs = _write_logs.get(key)
+    if refs is None:
+        refs = _write_logs[key] = []
+        # オブジェクトが回収されたら、そのidの記録も取り除く
+        weakref.finalize(obj, _write_logs.pop, key, None)
+    return refs
+
+
+def _tracked_memento(obj, deep):
+    log = _WriteLog(deep)
+    _logs_of(obj).append(weakref.ref(log))
+
+    def restore():
+        _restore_writes(obj, log)
+
+    return restore
+
+
+def _index_of(refs, log):
+    # 弱参照の==は参照先の==になり、_WriteLogはdictとして比べられるので、同一性で探す
+    return next((i for i, ref in enumerate(refs) if ref() is log), None)
+
+
+def _restore_writes(obj, log):
+    """記録された属性だけを元の値に戻す"""
+    refs = _write_logs.get(id(obj), [])
+    index = _index_of(refs, log)
+    if index is not None:
+        ref = refs.pop(index)
+    # 元に戻す書き込みも、他の記録には通常の書き込みとして記録させる
+    for name, value in log.items():
+        obj._record_write(name)
+        if value is _MISSING:
+            obj.__dict__.pop(name, None)
+        else:
+            obj.__dict__[name] = value
+    log.clear()
+    if index is not None:
+        refs.insert(index, ref)
 
 
 def memento(obj, deep=False):
+    if isinstance(obj, Tracked):
+        return _tracked_memento(obj, deep)
     state = deepcopy(obj.__dict__) if deep else copy(obj.__dict__)
 
     def restore():
@@ -67,6 +176,154 @@ class Transactional:
         return transaction
 
 
+def _call_transactional(method, obj, *args, **kwargs):
+    if not isinstance(obj, Tracked):
+        state = memento(obj)
+        try:
+            return method(obj, *args, **kwargs)
+        except Exception:
+            state()
+            raise
+
+    # 書き込まれた属性の元の値だけが、書き込みの時点で記録される
+    log = _WriteLog(False)
+    refs = _logs_of(obj)
+    refs.append(weakref.ref(log))
+    try:
+        return method(obj, *args, **kwargs)
+    except Exception:
+        _restore_writes(obj, log)
+        raise
+    finally:
+        del refs[_index_of(refs, log)]
+
+
+class FastTransactional(Transactional):
+    """
+    呼び出しのたびのコストを抑えたTransactional
+
+    ラッパーはデコレートしたときに1度だけ作り、アクセスのたびにクロージャーを作る代わりに
+    MethodTypeでインスタンスに束縛する。インスタンスには何も保存しないので、
+    コピーしたオブジェクトのメソッドはコピー自身に対して動く。Trackedのオブジェクトでは
+    呼び出し前に__dict__をコピーせず、書き換えられた属性の元の値だけを記録する。
+    """
+
+    def __init__(self, method):
+        super().__init__(method)
+        self._call = partial(_call_transactional, method)
+
+    def __get__(self, obj, T):
+        if obj is None:
+            return self
+        return MethodType(self._call, obj)
+
+
+class _Snapshot:
+    """オブジェクトの状態。最初はそのまま保持し、freeze()でシリアライズする"""
+
+    __slots__ = ("state", "payload", "buffers", "compressed", "nbytes")
+
+    def __init__(self, state):
+        self.state = state
+        self.payload = None
+        self.buffers = []
+        self.compressed = False
+        self.nbytes = 0
+
+    def freeze(self, compress):
+        if self.state is None:
+            return
+        buffers = []
+        # プロトコル5では、bytearrayなどの大きなバッファをpickleの外に取り出せる
+        payload = pickle.dumps(self.state, protocol=5, buffer_callback=buffers.append)
+        self.buffers = [buffer.raw().tobytes() for buffer in buffers]
+        if compress:
+            payload = zlib.compress(payload)
+            self.buffers = [zlib.compress(buffer) for buffer in self.buffers]
+        self.payload = payload
+        self.compressed = compress
+        self.nbytes = len(payload) + sum(len(buffer) for buffer in self.buffers)
+        self.state = None
+
+    def thaw(self):
+        if self.state is not None:
+            return self.state
+        payload, buffers = self.payload, self.buffers
+        if self.compressed:
+            payload = zlib.decompress(payload)
+            buffers = [zlib.decompress(buffer) for buffer in buffers]
+        return pickle.loads(payload, buffers=buffers)
+
+
+class History:
+    """
+    オブジェクトの状態を複数段階で元に戻す（undo）、やり直す（redo）
+
+    snapshot()で現在の状態を記録し、undo()でその状態に戻す。
+    それぞれのスタックの最新のスナップショット以外はシリアライズされ、
+    その合計がmax_bytesを超えると、最も古いスナップショットから捨てられる。
+
+    :param obj: 状態を記録するオブジェクト
+    :param max_bytes: シリアライズしたスナップショットの合計の上限
+    :param compress: Trueの場合、シリアライズしたスナップショットをzlibで圧縮する
+    """
+
+    def __init__(self, obj, max_bytes=1 << 26, compress=False):
+        self.obj = obj
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self._undo = []
+        self._redo = []
+
+    @property
+    def nbytes(self):
+        return sum(snapshot.nbytes for snapshot in self._undo + self._redo)
+
+    @property
+    def undo_depth(self):
+        return len(self._undo)
+
+    @property
+    def redo_depth(self):
+        return len(self._redo)
+
+    def snapshot(self):
+        """現在の状態を記録する。やり直せる操作は破棄される"""
+        self._redo.clear()
+        self._push(self._undo)
+
+    def undo(self):
+        """直前に記録した状態に戻す。戻せる状態がなければFalseを返す"""
+        return self._move(self._undo, self._redo)
+
+    def redo(self):
+        """undo()で戻す前の状態に進める。進める状態がなければFalseを返す"""
+        return self._move(self._redo, self._undo)
+
+    def _move(self, source, target):
+        if not source:
+            return False
+        self._push(target)
+        self._restore(source.pop().thaw())
+        return True
+
+    def _push(self, stack):
+        if stack:
+            stack[-1].freeze(self.compress)
+        stack.append(_Snapshot(deepcopy(self.obj.__dict__)))
+        self._evict()
+
+    def _evict(self):
+        total = self.nbytes
+        for stack in (self._undo, self._redo):
+            while total > self.max_bytes and len(stack) > 1:
+                total -= stack.pop(0).nbytes
+
+    def _restore(self, state):
+        self.obj.__dict__.clear()
+        self.obj.__dict__.update(state)
+
+
 class NumObj:
     def __init__(self, value):
         self.value = value
@@ -83,6 +340,22 @@ class NumObj:
         self.increment()  # <- 失敗してロールバック
 
 
+class Document(Tracked):
+    def __init__(self, title, body):
+        self.title = title
+        self.body = body
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__}: {self.title!r}>"
+
+    @FastTransactional
+    def publish(self, title):
+        self.title = title
+        self.body = self.body.upper()
+        if not title:
+            raise ValueError("title must not be empty")
+
+
 def main():
     """
     >>> num_obj = NumObj(-1)
@@ -134,6 +407,54 @@ def main():
 
     >>> print(num_obj)
     <NumObj: 2>
+
+    # Trackedのオブジェクトは、書き換えられた属性だけを記録して復元する
+    >>> document = Document('draft', 'x' * 10_000_000)
+    >>> doc_transaction = Transaction(False, document)
+    >>> document.title = 'final'
+    >>> document.author = 'me'
+    >>> print(document, document.author)
+    <Document: 'final'> me
+
+    >>> doc_transaction.rollback()
+    >>> print(document, hasattr(document, 'author'), len(document.body))
+    <Document: 'draft'> False 10000000
+
+    # FastTransactionalも、失敗した場合は書き換えた属性だけを元に戻す
+    >>> document.body = 'hello'
+    >>> document.publish('')
+    Traceback (most recent call last):
+    ...
+    ValueError: title must not be empty
+    >>> print(document, document.body)
+    <Document: 'draft'> hello
+    >>> document.publish('news')
+    >>> print(document, document.body)
+    <Document: 'news'> HELLO
+
+    # Historyで複数段階のundo/redoを行う
+    >>> counter = NumObj(0)
+    >>> history = History(counter, compress=True)
+    >>> for _ in range(3):
+    ...     history.snapshot()
+    ...     counter.increment()
+    >>> print(counter, history.undo_depth)
+    <NumObj: 3> 3
+
+    >>> history.undo(), history.undo()
+    (True, True)
+    >>> print(counter)
+    <NumObj: 1>
+    >>> history.redo()
+    True
+    >>> print(counter)
+    <NumObj: 2>
+
+    # 上限を超えると、古いスナップショットから捨てられる
+    >>> history.max_bytes = 0
+    >>> history.snapshot()
+    >>> history.undo_depth
+    1
     """
 
 
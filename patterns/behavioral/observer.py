@@ -3,6 +3,10 @@ http://code.activestate.com/recipes/131499-observer-pattern/
 
 *要約
 依存しているオブジェクトのリストを保持し、状態の変化を通知する。
+batch()の中や、coalesceをTrueにしている間の変更は、まとめて1回だけ通知する。
+オブザーバーは弱参照で保持するので、他から参照されなくなったオブザーバーは
+自動的に登録から外れる。
+Subject.executorを設定すると、通知をスレッドプールやasyncioのタスクで実行できる。
 
 *Pythonのエコシステムの例:
 Django Signals: https://docs.djangoproject.com/en/3.1/topics/signals/
@@ -11,8 +15,16 @@ Flask Signals: https://flask.palletsprojects.com/en/1.1.x/signals/
 
 from __future__ import annotations
 
-from contextlib import suppress
-from typing import Protocol
+import asyncio
+import inspect
+import time
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from types import MethodType
+from typing import Any, Callable, Hashable, Iterator, NamedTuple, Protocol, Union
 
 
 # 一般的なオブザーバータイプを定義する
@@ -21,22 +33,263 @@ class Observer(Protocol):
         pass
 
 
+# オブザーバーの代わりに、バウンドメソッドや関数などの呼び出し可能オブジェクトを
+# 直接登録することもできる。弱参照で保持されるので、参照を持ち続ける必要がある
+ObserverLike = Union[Observer, Callable[["Subject"], None]]
+
+# notify()に変更が渡されなかったことを表す。Noneへの変更と区別するために使う
+_NO_CHANGE = object()
+
+
+class WeakObserverSet:
+    """
+    オブザーバーを弱参照で、登録した順に保持する集合
+
+    登録・削除・存在確認はいずれも辞書の操作なのでO(1)で済む。
+    バウンドメソッドはWeakMethodで保持するため、一時的なメソッドオブジェクトではなく
+    メソッドの持ち主が生きている間だけ登録が残る。
+    """
+
+    def __init__(self) -> None:
+        self._refs: dict[Hashable, weakref.ref] = {}
+
+    @staticmethod
+    def _key(observer: ObserverLike) -> Hashable:
+        if isinstance(observer, MethodType):
+            return id(observer.__self__), id(observer.__func__)
+        return id(observer)
+
+    def add(self, observer: ObserverLike) -> None:
+        key = self._key(observer)
+        if key in self._refs:
+            return
+        refs = self._refs
+
+        def prune(ref: weakref.ref) -> None:
+            if refs.get(key) is ref:
+                del refs[key]
+
+        ref_type = (
+            weakref.WeakMethod if isinstance(observer, MethodType) else weakref.ref
+        )
+        refs[key] = ref_type(observer, prune)
+
+    def discard(self, observer: ObserverLike) -> None:
+        self._refs.pop(self._key(observer), None)
+
+    def __contains__(self, observer: ObserverLike) -> bool:
+        ref = self._refs.get(self._key(observer))
+        return ref is not None and ref() is not None
+
+    def __iter__(self) -> Iterator[ObserverLike]:
+        # 通知中にattach/detachされても影響を受けないよう、コピーをたどる
+        for ref in list(self._refs.values()):
+            observer = ref()
+            if observer is not None:
+                yield observer
+
+    def __len__(self) -> int:
+        return len(self._refs)
+
+
+class NotificationResult(NamedTuple):
+    """1つのオブザーバーへの通知にかかった時間（秒）と、送出された例外"""
+
+    observer: ObserverLike
+    elapsed: float
+    error: Exception | None
+
+
+def _timed_call(observer: ObserverLike, call: Callable[[], Any]) -> NotificationResult:
+    started = time.perf_counter()
+    try:
+        call()
+    except Exception as e:
+        return NotificationResult(observer, time.perf_counter() - started, e)
+    return NotificationResult(observer, time.perf_counter() - started, None)
+
+
+async def _timed_call_async(
+    observer: ObserverLike, call: Callable[[], Any]
+) -> NotificationResult:
+    """updateがコルーチン関数の場合は、その完了までを計測する"""
+    started = time.perf_counter()
+    try:
+        result = call()
+        if inspect.isawaitable(result):
+            await result
+    except Exception as e:
+        return NotificationResult(observer, time.perf_counter() - started, e)
+    return NotificationResult(observer, time.perf_counter() - started, None)
+
+
+class InlineExecutor:
+    """
+    通知を呼び出し元のスレッドで順に実行する
+
+    1つのオブザーバーが例外を送出しても、残りのオブザーバーには通知される。
+    各通知の結果は、直近のものがresultsに残る。
+    """
+
+    def __init__(self) -> None:
+        self.results: deque[NotificationResult] = deque(maxlen=1000)
+
+    def submit(self, calls: list[tuple[ObserverLike, Callable[[], Any]]]) -> None:
+        for observer, call in calls:
+            self.results.append(_timed_call(observer, call))
+
+
+class ThreadPoolNotificationExecutor(InlineExecutor):
+    """通知をスレッドプールで実行し、値を設定したスレッドを待たせない"""
+
+    def __init__(self, max_workers: int | None = None) -> None:
+        super().__init__()
+        self._pool = ThreadPoolExecutor(max_workers)
+
+    def submit(self, calls: list[tuple[ObserverLike, Callable[[], Any]]]) -> None:
+        for observer, call in calls:
+            future = self._pool.submit(_timed_call, observer, call)
+            future.add_done_callback(lambda f: self.results.append(f.result()))
+
+    def shutdown(self) -> None:
+        """実行中の通知がすべて終わるまで待つ"""
+        self._pool.shutdown()
+
+
+class AsyncioNotificationExecutor(InlineExecutor):
+    """
+    通知を実行中のイベントループのタスクとして実行する
+
+    updateがコルーチン関数のオブザーバーは、その完了まで待たれる。
+    イベントループの中から値を設定すること。
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._tasks: set[asyncio.Task] = set()
+
+    def submit(self, calls: list[tuple[ObserverLike, Callable[[], Any]]]) -> None:
+        loop = asyncio.get_running_loop()
+        for observer, call in calls:
+            task = loop.create_task(_timed_call_async(observer, call))
+            self._tasks.add(task)
+            task.add_done_callback(self._done)
+
+    async def wait(self) -> None:
+        """実行中の通知がすべて終わるまで待つ"""
+        while self._tasks:
+            await asyncio.gather(*self._tasks)
+
+    def _done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        self.results.append(task.result())
+
+
 class Subject:
+    """
+    オブザーバーに変更を通知する
+
+    batch()の中での通知はブロックを抜けるときに1回にまとめられる。
+    coalesceをTrueにすると、flush()を呼ぶまで通知を溜めておく（フレームごとに
+    1回通知する場合など）。まとめて通知する際、update_batch(subject, changes)を
+    持つオブザーバーには、その間の変更のリストが渡される。
+    """
+
     def __init__(self) -> None:
-        self._observers: list[Observer] = []
+        self._observers = WeakObserverSet()
+        # Noneの場合は、呼び出し元のスレッドで順に通知し、例外もそのまま送出する
+        self.executor: InlineExecutor | None = None
+        self.coalesce = False
+        self._batch_depth = 0
+        self._pending = False
+        self._pending_modifier: Observer | None = None
+        self._changes: list[Any] = []
+
+    def attach(self, observer: ObserverLike) -> None:
+        self._observers.add(observer)
+
+    def detach(self, observer: ObserverLike) -> None:
+        self._observers.discard(observer)
+
+    def notify(
+        self, modifier: Observer | None = None, change: Any = _NO_CHANGE
+    ) -> None:
+        if self.coalesce or self._batch_depth:
+            # すべての通知が同じmodifierからのものなら、まとめた通知でも除外する
+            if not self._pending:
+                self._pending_modifier = modifier
+            elif self._pending_modifier is not modifier:
+                self._pending_modifier = None
+            self._pending = True
+            if change is not _NO_CHANGE:
+                self._changes.append(change)
+            return
+        self._notify_observers(modifier)
+
+    def flush(self) -> None:
+        """溜まっている通知があれば、オブザーバーに1回だけ通知する"""
+        if not self._pending:
+            return
+        modifier, changes = self._pending_modifier, self._changes
+        self._pending = False
+        self._pending_modifier = None
+        self._changes = []
+        # 変更が1つも渡されていなければ、update_batchではなくupdateで通知する
+        self._notify_observers(modifier, changes or None)
 
-    def attach(self, observer: Observer) -> None:
-        if observer not in self._observers:
-            self._observers.append(observer)
+    async def notify_async(
+        self, modifier: Observer | None = None
+    ) -> list[NotificationResult]:
+        """
+        すべてのオブザーバーに並行して通知し、その完了を待つ
 
-    def detach(self, observer: Observer) -> None:
-        with suppress(ValueError):
-            self._observers.remove(observer)
+        updateがコルーチン関数のオブザーバーは、その完了まで待たれる。
+        オブザーバーが送出した例外は、送出されずに結果に含まれる。
+        """
+        calls = self._update_calls(modifier)
+        return list(
+            await asyncio.gather(
+                *(_timed_call_async(observer, call) for observer, call in calls)
+            )
+        )
 
-    def notify(self, modifier: Observer | None = None) -> None:
+    @contextmanager
+    def batch(self) -> Iterator[Subject]:
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and not self.coalesce:
+                self.flush()
+
+    def _notify_observers(
+        self, modifier: Observer | None, changes: list[Any] | None = None
+    ) -> None:
+        calls = self._update_calls(modifier, changes)
+        if self.executor is not None:
+            self.executor.submit(calls)
+            return
+        for _, call in calls:
+            call()
+
+    def _update_calls(
+        self, modifier: Observer | None, changes: list[Any] | None = None
+    ) -> list[tuple[ObserverLike, Callable[[], Any]]]:
+        """通知するオブザーバーと、引数を束縛した呼び出しの組のリストを返す"""
+        calls = []
         for observer in self._observers:
-            if modifier != observer:
-                observer.update(self)
+            if modifier == observer:
+                continue
+            if isinstance(observer, MethodType) or not hasattr(observer, "update"):
+                # バウンドメソッドや関数などの呼び出し可能オブジェクトは、直接呼び出す
+                call = partial(observer, self)
+            elif changes is not None and hasattr(observer, "update_batch"):
+                call = partial(observer.update_batch, self, changes)
+            else:
+                call = partial(observer.update, self)
+            calls.append((observer, call))
+        return calls
 
 
 class Data(Subject):
@@ -52,7 +305,7 @@ class Data(Subject):
     @data.setter
     def data(self, value: int) -> None:
         self._data = value
-        self.notify()
+        self.notify(change=value)
 
 
 class HexViewer:
@@ -65,6 +318,14 @@ class DecimalViewer:
         print(f"DecimalViewer: Subject {subject.name} has data {subject.data}")
 
 
+class HistoryViewer:
+    def update(self, subject: Data) -> None:
+        print(f"HistoryViewer: Subject {subject.name} has data {subject.data}")
+
+    def update_batch(self, subject: Data, changes: list[int]) -> None:
+        print(f"HistoryViewer: Subject {subject.name} changed {changes}")
+
+
 def main():
     """
     >>> data1 = Data('Data 1')
@@ -101,6 +362,64 @@ def main():
 
     >>> data2.data = 15
     DecimalViewer: Subject Data 2 has data 15
+
+    # batch()の中の変更は、ブロックを抜けるときに1回だけ通知される
+    >>> view3 = HistoryViewer()
+    >>> data1.attach(view3)
+    >>> with data1.batch():
+    ...     for value in range(1, 4):
+    ...         data1.data = value
+    DecimalViewer: Subject Data 1 has data 3
+    HistoryViewer: Subject Data 1 changed [1, 2, 3]
+
+    # coalesceをTrueにすると、flush()を呼ぶまで通知が溜められる
+    >>> data1.coalesce = True
+    >>> data1.data = 7
+    >>> data1.data = 8
+    >>> data1.flush()
+    DecimalViewer: Subject Data 1 has data 8
+    HistoryViewer: Subject Data 1 changed [7, 8]
+
+    # オブザーバーは弱参照で保持され、削除されると自動的に登録から外れる
+    >>> data3 = Data('Data 3')
+    >>> view4 = DecimalViewer()
+    >>> data3.attach(view4)
+    >>> data3.attach(view4.update)
+    >>> data3.data = 1
+    DecimalViewer: Subject Data 3 has data 1
+    DecimalViewer: Subject Data 3 has data 1
+    >>> del view4
+    >>> len(data3._observers)
+    0
+
+    # executorを設定すると、通知ごとの例外と時間が記録される
+    >>> class BrokenViewer:
+    ...     def update(self, subject):
+    ...         raise ValueError("broken")
+    >>> view5 = BrokenViewer()
+    >>> view6 = DecimalViewer()
+    >>> data3.attach(view5)
+    >>> data3.attach(view6)
+    >>> data3.executor = InlineExecutor()
+    >>> data3.data = 2
+    DecimalViewer: Subject Data 3 has data 2
+    >>> [type(result.error).__name__ for result in data3.executor.results]
+    ['ValueError', 'NoneType']
+
+    # コルーチン関数のupdateは、notify_async()で並行して待つことができる
+    >>> import asyncio
+    >>> class AsyncViewer:
+    ...     async def update(self, subject):
+    ...         await asyncio.sleep(0)
+    ...         print(f"AsyncViewer: Subject {subject.name} has data {subject.data}")
+    >>> view7 = AsyncViewer()
+    >>> data3.detach(view5)
+    >>> data3.attach(view7)
+    >>> results = asyncio.run(data3.notify_async())
+    DecimalViewer: Subject Data 3 has data 2
+    AsyncViewer: Subject Data 3 has data 2
+    >>> [result.error for result in results]
+    [None, None]
     """
 
 
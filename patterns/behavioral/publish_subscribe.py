@@ -2,28 +2,393 @@
 参照:
 http://www.slideshare.net/ishraqabd/publish-subscribe-model-overview-13368808
 著者: https://github.com/HanWenfang
+
+メッセージは"sports.tennis"のように"."で区切った階層を持つトピックとして扱う。
+購読には、1階層に一致する"*"と、0階層以上に一致する"#"を含むパターンも使える。
+"#"は"#.error"や"sports.#.final"のように、末尾以外にも置ける。
+
+ProviderにDispatcherを渡すと、update()はメッセージを購読者ごとにまとめて
+スレッドプールに渡すだけになり、遅い購読者が他の購読者を待たせなくなる。
+
+ProviderにMessageLogを渡すと、メッセージはメモリ上のキューではなく
+ディスク上の追記専用のログに書き込まれる。プロセスがupdate()の前に
+終了してもメッセージは失われず、後から購読した購読者に過去のメッセージを
+再配信（replay）することもできる。ログにはUTF-8で書き込むので、
+この場合のメッセージはstrに限られる。
 """
 
+import json
+import mmap
+import os
+import struct
+import threading
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# ワイルドカードとして扱う階層
+_WILDCARDS = ("*", "#")
+
+
+class _TopicNode:
+    """ワイルドカードを含む購読パターンを格納するトライ木のノード"""
+
+    __slots__ = ("children", "patterns")
 
-class Provider:
     def __init__(self):
+        self.children = {}
+        self.patterns = []
+
+
+class Provider:
+    # 配信先の表をキャッシュするトピックの最大数
+    max_routes = 10000
+
+    def __init__(self, dispatcher=None, log=None):
         self.msg_queue = []
+        self.dispatcher = dispatcher
+        self.log = log
+        # 購読パターン -> {購読者: 購読した順番}
         self.subscribers = {}
+        self._wildcard_root = _TopicNode()
+        self._routes = {}
+        self._sequence = 0
+        # ログを使う場合の、購読者名 -> 購読者
+        self._durable_names = {}
 
     def notify(self, msg):
-        self.msg_queue.append(msg)
+        if self.log is not None:
+            if not isinstance(msg, str):
+                raise TypeError(
+                    f"messages must be str when a log is used, not {type(msg).__name__}"
+                )
+            self.log.append(msg)
+        else:
+            self.msg_queue.append(msg)
 
     def subscribe(self, msg, subscriber):
-        self.subscribers.setdefault(msg, []).append(subscriber)
+        # ログの配信済みオフセットは購読者名で記録するので、名前は購読者を一意に表す必要がある。
+        # 再起動後に同じ名前で購読すると、続きから受け取る。
+        if self.log is not None:
+            owner = self._durable_names.setdefault(subscriber.name, subscriber)
+            if owner is not subscriber:
+                raise ValueError(
+                    f"another subscriber named {subscriber.name!r} is already subscribed"
+                )
+        if msg not in self.subscribers and _is_wildcard(msg):
+            node = self._wildcard_root
+            for level in msg.split("."):
+                node = node.children.setdefault(level, _TopicNode())
+            node.patterns.append(msg)
+        self._sequence += 1
+        self.subscribers.setdefault(msg, {}).setdefault(subscriber, self._sequence)
+        self._routes.clear()
+        # 新しい購読者は、購読した時点以降のメッセージから受け取る
+        if self.log is not None and self.log.offset(subscriber.name) is None:
+            self.log.commit({subscriber.name: self.log.end})
 
     def unsubscribe(self, msg, subscriber):
-        self.subscribers[msg].remove(subscriber)
+        del self.subscribers[msg][subscriber]
+        self._routes.clear()
 
     def update(self):
-        for msg in self.msg_queue:
-            for sub in self.subscribers.get(msg, []):
+        if self.dispatcher is not None:
+            batches = {}
+            for msg, subs in self._pending():
+                for sub in subs:
+                    batches.setdefault(sub, []).append(msg)
+            for sub, msgs in batches.items():
+                self.dispatcher.submit(sub, msgs)
+            return
+
+        for msg, subs in self._pending():
+            for sub in subs:
                 sub.run(msg)
-        self.msg_queue = []
+
+    def replay(self, subscriber, offset=0):
+        """ログのoffset番目以降のメッセージのうち、購読しているものを再配信する"""
+        for _, record in self.log.read(offset):
+            msg = str(record, "utf-8")
+            if subscriber in self._route(msg):
+                subscriber.run(msg)
+
+    def _pending(self):
+        """未配信のメッセージと、その配信先の組を順に返す"""
+        if self.log is None:
+            for msg in self.msg_queue:
+                yield msg, self._route(msg)
+            self.msg_queue = []
+            return
+
+        subscribers = {sub for subs in self.subscribers.values() for sub in subs}
+        offsets = {sub: self.log.offset(sub.name) for sub in subscribers}
+        end = self.log.end
+        for offset, record in self.log.read(min(offsets.values(), default=end)):
+            if offset >= end:
+                break
+            msg = str(record, "utf-8")
+            yield msg, [sub for sub in self._route(msg) if offsets[sub] <= offset]
+        self.log.commit({sub.name: end for sub in subscribers})
+
+    def _route(self, msg):
+        """トピックの配信先を、購読された順に並べたタプルで返す"""
+        route = self._routes.get(msg)
+        if route is None:
+            if len(self._routes) >= self.max_routes:
+                self._routes.clear()
+            route = self._routes[msg] = self._compile_route(msg)
+        return route
+
+    def _compile_route(self, msg):
+        patterns = []
+        if self._wildcard_root.children and isinstance(msg, str):
+            _match(self._wildcard_root, msg.split("."), 0, patterns)
+        exact = self.subscribers.get(msg, {})
+        if not patterns:
+            return tuple(exact)
+
+        # 複数のパターンに一致しても、配信は購読者ごとに1回にする
+        merged = dict(exact)
+        for pattern in patterns:
+            for subscriber, sequence in self.subscribers[pattern].items():
+                merged[subscriber] = min(sequence, merged.get(subscriber, sequence))
+        return tuple(sorted(merged, key=merged.get))
+
+
+def _is_wildcard(msg):
+    return isinstance(msg, str) and any(level in _WILDCARDS for level in msg.split("."))
+
+
+def _match(node, levels, index, patterns):
+    """levels[index:]に一致するパターンをトライ木から集める"""
+    any_levels = node.children.get("#")
+    if any_levels is not None:
+        # "#"はどの位置でも0階層以上に一致するので、残りの階層のすべての分け方を試す
+        for rest in range(index, len(levels) + 1):
+            _match(any_levels, levels, rest, patterns)
+    if index == len(levels):
+        patterns.extend(node.patterns)
+        return
+    for key in (levels[index], "*"):
+        child = node.children.get(key)
+        if child is not None:
+            _match(child, levels, index + 1, patterns)
+
+
+class MessageLog:
+    """
+    メッセージを長さ付きのレコードとしてセグメントファイルに追記するログ
+
+    各レコードには0から始まる連番（オフセット）が付く。セグメントファイルは
+    "<最初のオフセット>.log"という名前で、segment_bytesを超えると次のファイルに移る。
+    読み込みはmmapしたファイルのmemoryviewを切り出すだけで、コピーは発生しない。
+    購読者ごとに配信済みのオフセットを"offsets.json"に記録する。
+
+    :param directory: セグメントファイルを置くディレクトリ
+    :param segment_bytes: 1つのセグメントファイルの目安の大きさ
+    :param sync: Trueの場合、追記のたびにos.fsync()でディスクに書き出す
+    """
+
+    _HEADER = struct.Struct(">I")
+
+    def __init__(self, directory, segment_bytes=1 << 24, sync=False):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.sync = sync
+        self._segments = sorted(
+            int(name[:-4]) for name in os.listdir(directory) if name.endswith(".log")
+        ) or [0]
+        self._views = {}
+        base = self._segments[-1]
+        self.end = base + self._recover(base)
+        self._file = open(self._segment_path(base), "ab")
+        self._offsets_path = os.path.join(directory, "offsets.json")
+        self._offsets = {}
+        if os.path.exists(self._offsets_path):
+            with open(self._offsets_path) as f:
+                self._offsets = json.load(f)
+
+    def append(self, msg):
+        """メッセージを追記し、そのオフセットを返す"""
+        if self._file.tell() >= self.segment_bytes:
+            self._file.close()
+            self._segments.append(self.end)
+            self._file = open(self._segment_path(self.end), "ab")
+        data = msg.encode("utf-8")
+        self._file.write(self._HEADER.pack(len(data)))
+        self._file.write(data)
+        self._file.flush()
+        if self.sync:
+            os.fsync(self._file.fileno())
+        self.end += 1
+        return self.end - 1
+
+    def read(self, offset=0):
+        """offset番目以降のレコードを(オフセット, memoryview)の組で返す"""
+        header_size = self._HEADER.size
+        first = max(bisect_right(self._segments, offset) - 1, 0)
+        for base in self._segments[first:]:
+            view = self._view(base)
+            position = 0
+            current = base
+            while position + header_size <= len(view):
+                (length,) = self._HEADER.unpack_from(view, position)
+                start = position + header_size
+                position = start + length
+                if position > len(view):
+                    break
+                if current >= offset:
+                    yield current, view[start:position]
+                current += 1
+
+    def offset(self, name):
+        """購読者nameが次に受け取るオフセット。記録がなければNone"""
+        return self._offsets.get(name)
+
+    def commit(self, offsets):
+        """{購読者名: 次に受け取るオフセット}を記録する"""
+        self._offsets.update(offsets)
+        temporary = self._offsets_path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(self._offsets, f)
+        os.replace(temporary, self._offsets_path)
+
+    def close(self):
+        self._file.close()
+        self._views.clear()
+
+    def _segment_path(self, base):
+        return os.path.join(self.directory, f"{base:020d}.log")
+
+    def _view(self, base):
+        path = self._segment_path(base)
+        size = os.path.getsize(path)
+        cached = self._views.get(base)
+        if cached is None or cached[0] != size:
+            if size == 0:
+                return memoryview(b"")
+            with open(path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # 切り出したmemoryviewが残っていても安全なように、mmapは閉じずに
+            # 参照がなくなったときに解放させる
+            cached = self._views[base] = (size, memoryview(mapped))
+        return cached[1]
+
+    def _recover(self, base):
+        """
+        セグメントに含まれる完全なレコードの数を返す。
+
+        書き込み途中で終了した場合に残る、不完全なレコードは切り捨てる。
+        """
+        path = self._segment_path(base)
+        if not os.path.exists(path):
+            return 0
+        with open(path, "rb") as f:
+            data = f.read()
+        count = position = 0
+        while position + self._HEADER.size <= len(data):
+            (length,) = self._HEADER.unpack_from(data, position)
+            end = position + self._HEADER.size + length
+            if end > len(data):
+                break
+            count += 1
+            position = end
+        if position < len(data):
+            with open(path, "r+b") as f:
+                f.truncate(position)
+        return count
+
+
+class Dispatcher:
+    """
+    購読者ごとのキューに溜めたメッセージを、スレッドプールで配信する
+
+    1人の購読者に対しては常に1つのスレッドだけが配信するので、
+    メッセージは送られた順に届く。購読者がrun_batch(msgs)を持つ場合は、
+    溜まっていたメッセージをリストでまとめて渡す。
+
+    :param max_workers: 配信に使うスレッドの数
+    :param queue_size: 購読者ごとのキューに溜められるメッセージの最大数
+    :param overflow: キューが一杯のときの動作。"block"は空くまで待ち、
+    "drop_oldest"は最も古いメッセージを、"drop_newest"は新しいメッセージを捨てる
+    """
+
+    OVERFLOW_POLICIES = ("block", "drop_oldest", "drop_newest")
+
+    def __init__(self, max_workers=4, queue_size=1000, overflow="block"):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {self.OVERFLOW_POLICIES}")
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.dropped = 0
+        # 配信中に購読者が送出した例外（購読者, 例外）の直近の記録
+        self.errors = deque(maxlen=100)
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._condition = threading.Condition()
+        self._mailboxes = {}
+        self._running = set()
+
+    def submit(self, subscriber, msgs):
+        with self._condition:
+            mailbox = self._mailboxes.setdefault(subscriber, deque())
+            for msg in msgs:
+                if len(mailbox) >= self.queue_size:
+                    if self.overflow == "drop_newest":
+                        self.dropped += 1
+                        continue
+                    if self.overflow == "drop_oldest":
+                        mailbox.popleft()
+                        self.dropped += 1
+                    else:
+                        self._schedule(subscriber)
+                        while len(mailbox) >= self.queue_size:
+                            self._condition.wait()
+                mailbox.append(msg)
+            self._schedule(subscriber)
+
+    def join(self):
+        """キューに溜まったメッセージがすべて配信されるまで待つ"""
+        with self._condition:
+            while self._running:
+                self._condition.wait()
+
+    def shutdown(self):
+        self.join()
+        self._executor.shutdown()
+
+    def _schedule(self, subscriber):
+        if subscriber not in self._running and self._mailboxes[subscriber]:
+            self._running.add(subscriber)
+            self._executor.submit(self._drain, subscriber)
+
+    def _drain(self, subscriber):
+        while True:
+            with self._condition:
+                mailbox = self._mailboxes[subscriber]
+                batch = list(mailbox)
+                mailbox.clear()
+                if not batch:
+                    self._running.discard(subscriber)
+                self._condition.notify_all()
+            if not batch:
+                return
+            self._deliver(subscriber, batch)
+
+    def _deliver(self, subscriber, batch):
+        run_batch = getattr(subscriber, "run_batch", None)
+        if run_batch is not None:
+            self._call(subscriber, run_batch, batch)
+        else:
+            for msg in batch:
+                self._call(subscriber, subscriber.run, msg)
+
+    def _call(self, subscriber, run, arg):
+        # 1人の購読者の失敗で、他のメッセージの配信を止めない
+        try:
+            run(arg)
+        except Exception as e:
+            self.errors.append((subscriber, e))
 
 
 class Publisher:
@@ -49,6 +414,11 @@ class Subscriber:
         print(f"{self.name} got {msg}")
 
 
+class BatchSubscriber(Subscriber):
+    def run_batch(self, msgs):
+        print(f"{self.name} got {', '.join(msgs)}")
+
+
 def main():
     """
     >>> message_center = Provider()
@@ -83,6 +453,60 @@ def main():
     jim got cartoon
     jim got cartoon
     gee got movie
+
+    # ワイルドカードで複数のトピックをまとめて購読する
+    >>> sports_center = Provider()
+    >>> espn = Publisher(sports_center)
+    >>> Subscriber("ann", sports_center).subscribe("sports.*")
+    >>> Subscriber("bob", sports_center).subscribe("sports.#")
+    >>> Subscriber("cid", sports_center).subscribe("sports.tennis")
+
+    >>> espn.publish("sports.tennis")
+    >>> espn.publish("sports.tennis.final")
+    >>> espn.publish("sports")
+    >>> espn.publish("news")
+
+    >>> sports_center.update()
+    ann got sports.tennis
+    bob got sports.tennis
+    cid got sports.tennis
+    bob got sports.tennis.final
+    bob got sports
+
+    # スレッドプールで購読者ごとにまとめて配信する
+    >>> dispatcher = Dispatcher(max_workers=2)
+    >>> async_center = Provider(dispatcher)
+    >>> bbc = Publisher(async_center)
+    >>> BatchSubscriber("kim", async_center).subscribe("news")
+
+    >>> bbc.publish("news")
+    >>> bbc.publish("news")
+    >>> async_center.update(); dispatcher.shutdown()
+    kim got news, news
+
+    # ディスク上のログを使うと、update()の前に終了してもメッセージが残る
+    >>> import tempfile
+    >>> log_dir = tempfile.TemporaryDirectory()
+    >>> durable_center = Provider(log=MessageLog(log_dir.name))
+    >>> Subscriber("amy", durable_center).subscribe("weather")
+    >>> Publisher(durable_center).publish("weather")
+    >>> durable_center.log.close()
+
+    >>> restarted_center = Provider(log=MessageLog(log_dir.name))
+    >>> Subscriber("amy", restarted_center).subscribe("weather")
+    >>> Publisher(restarted_center).publish("weather")
+    >>> restarted_center.update()
+    amy got weather
+    amy got weather
+
+    # 後から購読した購読者には、過去のメッセージを再配信できる
+    >>> late = Subscriber("leo", restarted_center)
+    >>> late.subscribe("weather")
+    >>> restarted_center.update()
+    >>> restarted_center.replay(late, offset=1)
+    leo got weather
+    >>> restarted_center.log.close()
+    >>> log_dir.cleanup()
     """
 
 
@@ -17,22 +17,66 @@ https://github.com/pallets/werkzeug/blob/5a2bf35441006d832ab1ed5a31963cbc366c99a
 
 *要約
 式の評価をその値が必要になるまで遅らせ、繰り返される評価を回避する。
+複数のスレッドから同時に最初のアクセスがあっても、計算は1回だけ行われる。
 """
 
+import asyncio
 import functools
+import threading
+import time
+
+
+class _SingleFlight:
+    """
+    インスタンスごとのロックを、計算が終わるまでの間だけ保持する
+
+    ロックはデコレーターの側に持つので、インスタンスの__dict__には値しか残らない。
+    """
+
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._locks = {}
+
+    def run(self, obj, lookup, compute):
+        key = id(obj)
+        with self._guard:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                # 待っている間に別のスレッドが計算を終えていれば、その値を使う
+                try:
+                    return lookup()
+                except (KeyError, AttributeError):
+                    pass
+                # 例外処理の外で計算し、計算中の例外に上の例外が連鎖しないようにする
+                return compute()
+        finally:
+            with self._guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
 
 
 class lazy_property:
     def __init__(self, function):
         self.function = function
+        self._flight = _SingleFlight()
         functools.update_wrapper(self, function)
 
     def __get__(self, obj, type_):
+        # 値が保存された後は__dict__が優先されるので、ここには来ない
         if obj is None:
             return self
-        val = self.function(obj)
-        obj.__dict__[self.function.__name__] = val
-        return val
+        name = self.function.__name__
+
+        def compute():
+            val = obj.__dict__[name] = self.function(obj)
+            return val
+
+        return self._flight.run(obj, lambda: obj.__dict__[name], compute)
 
 
 def lazy_property2(fn):
@@ -42,16 +86,165 @@ def lazy_property2(fn):
     デコレーター関数は、最初は結果を取得するために呼び出され、以降はその計算結果が使用される。
     """
     attr = "_lazy__" + fn.__name__
+    flight = _SingleFlight()
+
+    def compute(self):
+        setattr(self, attr, fn(self))
+        return getattr(self, attr)
 
     @property
     def _lazy_property(self):
-        if not hasattr(self, attr):
-            setattr(self, attr, fn(self))
-        return getattr(self, attr)
+        try:
+            return getattr(self, attr)
+        except AttributeError:
+            return flight.run(
+                self, lambda: getattr(self, attr), functools.partial(compute, self)
+            )
 
     return _lazy_property
 
 
+class lazy_attribute:
+    """
+    設定可能な遅延プロパティー
+
+    lazy_propertyとは異なり、値は別の属性(既定では"_lazy__" + 関数名)に保存されるので、
+    その名前を__slots__に含めれば__slots__のクラスでも使える。アクセスのたびに次の場合は
+    値を計算し直す。
+
+    * ttl秒が経過した場合
+    * depends_onに指定した属性に、計算した時とは別のオブジェクトが代入された場合
+    * invalidate(obj)が呼ばれた場合
+    """
+
+    def __init__(
+        self,
+        function=None,
+        *,
+        ttl=None,
+        depends_on=(),
+        storage=None,
+        clock=time.monotonic
+    ):
+        self.ttl = ttl
+        self.depends_on = tuple(depends_on)
+        self.storage = storage
+        self.clock = clock
+        self.function = None
+        self._flight = _SingleFlight()
+        if function is not None:
+            self(function)
+
+    def __call__(self, function):
+        self.function = function
+        if self.storage is None:
+            self.storage = "_lazy__" + function.__name__
+        functools.update_wrapper(self, function)
+        return self
+
+    def __get__(self, obj, type_):
+        if obj is None:
+            return self
+        try:
+            return self._lookup(obj)
+        except AttributeError:
+            return self._flight.run(
+                obj,
+                functools.partial(self._lookup, obj),
+                functools.partial(self._compute, obj),
+            )
+
+    def invalidate(self, obj):
+        """保存された値を捨て、次のアクセスで計算し直させる"""
+        try:
+            delattr(obj, self.storage)
+        except AttributeError:
+            pass
+
+    def _lookup(self, obj):
+        # 値が無いか古い場合はAttributeErrorを送出する
+        value, deadline, deps = getattr(obj, self.storage)
+        if deadline is not None and self.clock() >= deadline:
+            raise AttributeError(self.storage)
+        for name, dep in zip(self.depends_on, deps):
+            if getattr(obj, name) is not dep:
+                raise AttributeError(self.storage)
+        return value
+
+    def _compute(self, obj):
+        deps = tuple(getattr(obj, name) for name in self.depends_on)
+        value = self.function(obj)
+        deadline = None if self.ttl is None else self.clock() + self.ttl
+        setattr(obj, self.storage, (value, deadline, deps))
+        return value
+
+
+class async_lazy_property:
+    """
+    非同期版の遅延プロパティー
+
+    最初のアクセスでコルーチンを1つのタスクとして開始し、そのタスクをインスタンスの
+    __dict__に保存する。以降の`await obj.attr`はすべて同じタスクを待つので、
+    同時に待っていても処理は1回だけ行われ、完了後はキャッシュされた結果が返る。
+    呼び出し側にはasyncio.shieldで包んだものを返すので、ある呼び出し側がタイムアウトなどで
+    キャンセルされても、共有しているタスクはキャンセルされない。
+
+    cache_errorsがFalseの場合、例外で終わったタスクは破棄され、次のアクセスで再実行される。
+    キャンセルされたタスクは、cache_errorsに関わらず常に破棄される。
+    `del obj.attr`でキャッシュを捨てることもできる。
+    """
+
+    def __init__(self, function=None, *, cache_errors=True):
+        self.cache_errors = cache_errors
+        self.function = None
+        if function is not None:
+            self(function)
+
+    def __call__(self, function):
+        self.function = function
+        functools.update_wrapper(self, function)
+        return self
+
+    def __get__(self, obj, type_):
+        # __delete__を持つデータディスクリプターなので、キャッシュ後もここを通る
+        if obj is None:
+            return self
+        # イベントループのスレッドからのみ呼ばれるので、ロックは必要ない
+        name = self.function.__name__
+        task = obj.__dict__.get(name)
+        if task is None:
+            # 実行中のイベントループの外ではRuntimeErrorになり、何もキャッシュされない
+            loop = asyncio.get_running_loop()
+            task = obj.__dict__[name] = loop.create_task(self.function(obj))
+            task.add_done_callback(functools.partial(self._done, obj, name))
+        return asyncio.shield(task)
+
+    def __delete__(self, obj):
+        obj.__dict__.pop(self.function.__name__, None)
+
+    def _done(self, obj, name, task):
+        if task.cancelled():
+            failed = True
+        else:
+            failed = task.exception() is not None and not self.cache_errors
+        if failed and obj.__dict__.get(name) is task:
+            del obj.__dict__[name]
+
+
+class Rectangle:
+    __slots__ = ("width", "height", "call_count", "_lazy__area")
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.call_count = 0
+
+    @lazy_attribute(depends_on=("width", "height"))
+    def area(self):
+        self.call_count += 1
+        return self.width * self.height
+
+
 class Person:
     def __init__(self, name, occupation):
         self.name = name
@@ -69,6 +262,12 @@ class Person:
         self.call_count2 += 1
         return "Father and mother"
 
+    @async_lazy_property
+    async def friends(self):
+        # ネットワーク越しの問い合わせなど、時間のかかる非同期処理と仮定する
+        await asyncio.sleep(0.01)
+        return "Some friends."
+
 
 def main():
     """
@@ -101,6 +300,25 @@ def main():
 
     >>> Jhon.call_count2
     1
+
+    # 非同期の遅延プロパティーは、同時に待っても1つのタスクを共有する
+    >>> async def read_friends():
+    ...     return await asyncio.gather(Jhon.friends, Jhon.friends)
+    >>> asyncio.run(read_friends())
+    ['Some friends.', 'Some friends.']
+    >>> Jhon.__dict__['friends'].done()
+    True
+
+    # lazy_attributeは__slots__のクラスでも使え、依存する属性が変わると計算し直す
+    >>> rect = Rectangle(2, 3)
+    >>> rect.area, rect.area, rect.call_count
+    (6, 6, 1)
+    >>> rect.width = 10
+    >>> rect.area, rect.call_count
+    (30, 2)
+    >>> Rectangle.area.invalidate(rect)
+    >>> rect.area, rect.call_count
+    (30, 3)
     """
 
 
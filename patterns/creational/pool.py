@@ -23,28 +23,440 @@ https://sourcemaking.com/design_patterns/object_pool
 
 *要約
 すぐに使用できる状態の初期化されたオブジェクトのセットを格納する。
+
+*BoundedObjectPool
+ObjectPoolは呼び出し側が用意したキューを包むだけだが、BoundedObjectPoolは
+ファクトリー関数で必要に応じてオブジェクトを作成し、その数を上限までに抑える。
+上限に達している場合は、他のスレッドが返却するまで（timeoutまで）待機する。
+AsyncObjectPoolはその非同期版で、イベントループをブロックせずに待機する。
+
+ObjectPoolが返却されないまま削除された場合、オブジェクトはweakref.finalizeで
+キューに戻される。track_leaks=Trueを指定すると、その際に取得した場所の
+スタックトレースをResourceWarningで報告する。
+
+BoundedObjectPoolにPoolStatsを渡すと、待ち時間や使用時間の分布、
+同時に使用されている数などを記録し、snapshot()で取得できる。
 """
 
+import asyncio
+import threading
+import time
+import traceback
+import warnings
+import weakref
+from bisect import bisect_left
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
 
 class ObjectPool:
-    def __init__(self, queue, auto_get=False):
+    def __init__(self, queue, auto_get=False, track_leaks=False):
         self._queue = queue
-        self.item = self._queue.get() if auto_get else None
+        self._track_leaks = track_leaks
+        self._finalizer = None
+        self.item = None
+        if auto_get:
+            self._take()
 
     def __enter__(self):
         if self.item is None:
-            self.item = self._queue.get()
+            self._take()
         return self.item
 
     def __exit__(self, Type, value, traceback):
         if self.item is not None:
+            self._finalizer.detach()
             self._queue.put(self.item)
             self.item = None
 
-    def __del__(self):
-        if self.item is not None:
-            self._queue.put(self.item)
-            self.item = None
+    def _take(self):
+        self.item = self._queue.get()
+        acquired_at = traceback.extract_stack()[:-2] if self._track_leaks else None
+        # __del__と違い、コールバックはselfを参照しないので循環参照の影響を受けない
+        self._finalizer = weakref.finalize(
+            self, _reclaim_leaked, self._queue, self.item, acquired_at
+        )
+        self._finalizer.atexit = False
+
+
+def _reclaim_leaked(queue, item, acquired_at):
+    """返却されずに削除されたObjectPoolのオブジェクトをキューに戻す"""
+    if acquired_at is not None:
+        warnings.warn(
+            "ObjectPool item was not released; acquired at:\n"
+            + "".join(traceback.format_list(acquired_at)),
+            ResourceWarning,
+        )
+    queue.put(item)
+
+
+class BoundedObjectPool:
+    """
+    ファクトリーでオブジェクトを作成し、最大max_size個まで保持するスレッドセーフなプール
+
+    :param factory: 新しいオブジェクトを返す関数
+    :param min_size: 作成時に事前に用意しておくオブジェクトの数
+    :param max_size: 同時に存在できるオブジェクトの最大数
+    :param validate: 貸し出し前にオブジェクトを検査する関数。
+    Falseを返したオブジェクトは破棄され、別のオブジェクトが貸し出される
+    :param timeout: acquire()のデフォルトの待ち時間（秒）。Noneの場合は無期限に待つ
+    :param max_idle_time: 指定した場合（正の数）、これより長く（秒）使われていない
+    オブジェクトをバックグラウンドのスレッドが定期的に破棄する。
+    ただし、min_size個より少なくはしない
+    :param dispose: 破棄するオブジェクトを受け取って後始末をする関数
+    :param stats: 利用状況を記録するPoolStats。Noneの場合は何も記録しない
+    """
+
+    def __init__(
+        self,
+        factory,
+        min_size=0,
+        max_size=10,
+        validate=None,
+        timeout=None,
+        max_idle_time=None,
+        dispose=None,
+        stats=None,
+    ):
+        if not 0 <= min_size <= max_size:
+            raise ValueError("0 <= min_size <= max_size must hold")
+        # 0以下では、バックグラウンドのスレッドが待たずに回り続けてしまう
+        if max_idle_time is not None and max_idle_time <= 0:
+            raise ValueError("max_idle_time must be positive")
+        self._factory = factory
+        self._validate = validate
+        self._dispose = dispose
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle_time = max_idle_time
+        self.stats = stats
+        # (オブジェクト, 返却された時刻)の組。末尾ほど最近返却されたもの
+        self._idle = []
+        self._size = 0
+        self._condition = threading.Condition()
+        for _ in range(min_size):
+            self._idle.append((factory(), time.monotonic()))
+            self._size += 1
+            if stats is not None:
+                stats.record_create()
+        self._stop_reaper = None
+        if max_idle_time is not None:
+            self._start_reaper(max_idle_time / 2)
+
+    @property
+    def size(self):
+        """作成済みで破棄されていないオブジェクトの数"""
+        return self._size
+
+    @property
+    def idle(self):
+        """貸し出されていないオブジェクトの数"""
+        return len(self._idle)
+
+    def acquire(self, timeout=None):
+        """
+        オブジェクトを1つ借りる。
+
+        空いているオブジェクトがなく、上限にも達している場合は返却を待つ。
+        待ち時間がtimeoutを超えるとTimeoutErrorを送出する。
+        """
+        stats = self.stats
+        if stats is None:
+            return self._acquire(timeout)
+        started = time.perf_counter()
+        try:
+            item = self._acquire(timeout)
+        except TimeoutError:
+            stats.record_timeout()
+            raise
+        stats.record_acquire(item, time.perf_counter() - started)
+        return item
+
+    def _acquire(self, timeout):
+        if timeout is None:
+            timeout = self.timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            item, create = self._reserve(deadline)
+            if create:
+                if self.stats is not None:
+                    self.stats.record_create()
+                try:
+                    return self._factory()
+                except BaseException:
+                    self._discard()
+                    raise
+            try:
+                valid = self._validate is None or self._validate(item)
+            except BaseException:
+                # 検査自体が失敗したオブジェクトも破棄し、枠を空けてから送出する
+                self._discard()
+                if self._dispose is not None:
+                    self._dispose(item)
+                raise
+            if valid:
+                return item
+            self._discard()
+            if self._dispose is not None:
+                self._dispose(item)
+
+    def release(self, item):
+        """借りたオブジェクトをプールに返す"""
+        if self.stats is not None:
+            self.stats.record_release(item)
+        with self._condition:
+            self._idle.append((item, time.monotonic()))
+            self._condition.notify()
+
+    def evict_idle(self):
+        """max_idle_timeより長く使われていないオブジェクトを破棄する"""
+        if self.max_idle_time is None:
+            return
+        expired = []
+        with self._condition:
+            limit = time.monotonic() - self.max_idle_time
+            while (
+                self._idle and self._idle[0][1] < limit and self._size > self.min_size
+            ):
+                expired.append(self._idle.pop(0)[0])
+                self._size -= 1
+        if self._dispose is not None:
+            for item in expired:
+                self._dispose(item)
+
+    def close(self):
+        """バックグラウンドのスレッドを止め、空いているオブジェクトを破棄する"""
+        if self._stop_reaper is not None:
+            self._stop_reaper()
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        if self._dispose is not None:
+            for item, _ in idle:
+                self._dispose(item)
+
+    def _start_reaper(self, interval):
+        stop = threading.Event()
+        # スレッドがプールへの強い参照を持つと、プールが削除されなくなる
+        pool_ref = weakref.ref(self)
+
+        def reap():
+            while not stop.wait(interval):
+                pool = pool_ref()
+                if pool is None:
+                    return
+                pool.evict_idle()
+                del pool
+
+        self._stop_reaper = weakref.finalize(self, stop.set)
+        threading.Thread(target=reap, name="pool-reaper", daemon=True).start()
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        """withブロックの間だけオブジェクトを借りる"""
+        item = self.acquire(timeout)
+        try:
+            yield item
+        finally:
+            self.release(item)
+
+    def _reserve(self, deadline):
+        """
+        空いているオブジェクトを取り出すか、新しく作成する枠を確保する。
+
+        オブジェクトの作成と検査には時間がかかるかもしれないため、
+        ロックの外で行えるように(オブジェクト, 作成するか)の組を返す。
+        """
+        with self._condition:
+            while True:
+                if self._idle:
+                    return self._idle.pop()[0], False
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None, True
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("no object became available in the pool")
+                self._condition.wait(remaining)
+
+    def _discard(self):
+        """オブジェクトを1つ破棄し、その分の枠を空ける"""
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+
+class PoolStats:
+    """
+    BoundedObjectPoolの利用状況を記録する
+
+    待ち時間と使用時間は、BUCKETSの各上限（秒）以下に収まった回数として
+    ヒストグラムに記録する。
+    """
+
+    BUCKETS = (0.001, 0.01, 0.1, 1.0, 10.0, float("inf"))
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._acquired_at = {}
+        self.created = 0
+        self.timeouts = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.wait_time = [0] * len(self.BUCKETS)
+        self.hold_time = [0] * len(self.BUCKETS)
+
+    def record_create(self):
+        with self._lock:
+            self.created += 1
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def record_acquire(self, item, waited):
+        with self._lock:
+            self._acquired_at[id(item)] = time.perf_counter()
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            self.wait_time[bisect_left(self.BUCKETS, waited)] += 1
+
+    def record_release(self, item):
+        with self._lock:
+            acquired_at = self._acquired_at.pop(id(item), None)
+            if acquired_at is None:
+                return
+            self.in_use -= 1
+            held = time.perf_counter() - acquired_at
+            self.hold_time[bisect_left(self.BUCKETS, held)] += 1
+
+    def snapshot(self):
+        """現在の値を辞書で返す。ヒストグラムは{上限: 回数}の辞書になる"""
+        with self._lock:
+            return {
+                "created": self.created,
+                "timeouts": self.timeouts,
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "wait_time": dict(zip(self.BUCKETS, self.wait_time)),
+                "hold_time": dict(zip(self.BUCKETS, self.hold_time)),
+            }
+
+
+# 待機中のコルーチンに、オブジェクトの代わりに「新しく作成してよい枠」を渡す印
+_NEW_SLOT = object()
+
+
+class AsyncObjectPool:
+    """
+    asyncio用のオブジェクトプール
+
+    :param factory: 新しいオブジェクトを返すコルーチン関数
+    :param max_size: 同時に存在できるオブジェクトの最大数
+    :param timeout: acquire()のデフォルトの待ち時間（秒）。Noneの場合は無期限に待つ
+
+    待機しているコルーチンには、待ち始めた順にオブジェクトが渡される。
+    待機中にキャンセルされたりタイムアウトしたりしても、
+    受け取りかけていたオブジェクトがプールから失われることはない。
+    """
+
+    def __init__(self, factory, max_size=10, timeout=None):
+        self._factory = factory
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = []
+        self._size = 0
+        self._waiters = deque()
+
+    @property
+    def size(self):
+        """作成済みで破棄されていないオブジェクトの数"""
+        return self._size
+
+    @property
+    def idle(self):
+        """貸し出されていないオブジェクトの数"""
+        return len(self._idle)
+
+    async def acquire(self, timeout=None):
+        """
+        オブジェクトを1つ借りる。
+
+        空いているオブジェクトがなく、上限にも達している場合は返却を待つ。
+        待ち時間がtimeoutを超えるとTimeoutErrorを送出する。
+        """
+        if self._idle:
+            return self._idle.pop()
+        if self._size < self.max_size:
+            self._size += 1
+            item = _NEW_SLOT
+        else:
+            item = await self._wait(self.timeout if timeout is None else timeout)
+        if item is not _NEW_SLOT:
+            return item
+        try:
+            return await self._factory()
+        except BaseException:
+            self.discard()
+            raise
+
+    def release(self, item):
+        """借りたオブジェクトを、待機中のコルーチンかプールに返す"""
+        if not self._wake(item):
+            self._idle.append(item)
+
+    def discard(self):
+        """壊れたオブジェクトなどを返却せずに破棄し、その分の枠を空ける"""
+        if not self._wake(_NEW_SLOT):
+            self._size -= 1
+
+    @asynccontextmanager
+    async def checkout(self, timeout=None):
+        """async withブロックの間だけオブジェクトを借りる"""
+        item = await self.acquire(timeout)
+        try:
+            yield item
+        finally:
+            self.release(item)
+
+    async def _wait(self, timeout):
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        handle = None
+        if timeout is not None:
+            handle = loop.call_later(timeout, self._expire, waiter)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            # 受け取った直後にキャンセルされた場合は、次の待機者に回す
+            if not waiter.cancelled() and waiter.exception() is None:
+                self._give_back(waiter.result())
+            raise
+        finally:
+            if handle is not None:
+                handle.cancel()
+
+    def _wake(self, item):
+        """先頭の待機中のコルーチンにitemを渡す。渡せなければFalseを返す"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(item)
+                return True
+        return False
+
+    def _give_back(self, item):
+        if item is _NEW_SLOT:
+            self.discard()
+        else:
+            self.release(item)
+
+    @staticmethod
+    def _expire(waiter):
+        if not waiter.done():
+            waiter.set_exception(TimeoutError("no object became available in the pool"))
 
 
 def main():
@@ -74,6 +486,50 @@ def main():
 
     if not sample_queue.empty():
         print(sample_queue.get())
+
+    >>> pool = BoundedObjectPool(lambda: object(), min_size=1, max_size=2)
+    >>> pool.size, pool.idle
+    (1, 1)
+    >>> with pool.checkout() as first, pool.checkout() as second:
+    ...    print(first is second, pool.size, pool.idle)
+    False 2 0
+    >>> pool.size, pool.idle
+    (2, 2)
+
+    >>> item = pool.acquire()
+    >>> item = pool.acquire()
+    >>> pool.acquire(timeout=0.01)
+    Traceback (most recent call last):
+    ...
+    TimeoutError: no object became available in the pool
+
+    >>> stats = PoolStats()
+    >>> pool = BoundedObjectPool(object, max_size=1, stats=stats)
+    >>> with pool.checkout():
+    ...    pool.acquire(timeout=0)
+    Traceback (most recent call last):
+    ...
+    TimeoutError: no object became available in the pool
+    >>> snapshot = stats.snapshot()
+    >>> snapshot['created'], snapshot['timeouts'], snapshot['in_use'], snapshot['peak_in_use']
+    (1, 1, 0, 1)
+    >>> sum(snapshot['hold_time'].values())
+    1
+
+    >>> import asyncio
+
+    >>> async def connect():
+    ...    return object()
+
+    >>> async def use_async_pool():
+    ...    async_pool = AsyncObjectPool(connect, max_size=1)
+    ...    async with async_pool.checkout() as first:
+    ...        pass
+    ...    async with async_pool.checkout() as second:
+    ...        print(first is second, async_pool.size)
+
+    >>> asyncio.run(use_async_pool())
+    True 1
     """
 
 
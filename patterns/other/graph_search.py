@@ -1,15 +1,195 @@
+import time
+from array import array
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from heapq import heappop, heappush
+from itertools import count, islice
+
+
+class CSRGraph(Mapping):
+
+    """圧縮行格納形式（Compressed Sparse Row）で保持した読み取り専用のグラフ
+
+    ノードのラベルは0から始まる整数のIDに変換し、隣接ノードのIDを
+    1本の`array`に連続して並べる。ノード`i`の隣接ノードは
+    `neighbors[offsets[i]:offsets[i + 1]]`に格納される。
+    辺1本あたり4バイトで済むため、リストの辞書よりはるかに小さい。
+    重み付きのグラフでは、辺の重みを`neighbors`と同じ並びの`weights`に持つ。
+
+    `Mapping`として振る舞うので、`GraphSearch`にそのまま渡せる。"""
+
+    def __init__(self, labels, offsets, neighbors, weights=None):
+        self.labels = labels
+        self.index = {label: node_id for node_id, label in enumerate(labels)}
+        self.offsets = offsets
+        self.neighbors = neighbors
+        self.weights = weights
+
+    @classmethod
+    def from_dict(cls, graph):
+        """隣接リスト、または`{隣接ノード: 重み}`の辞書から作成する"""
+        edges = (
+            (
+                (node, neighbor, neighbors[neighbor])
+                if isinstance(neighbors, Mapping)
+                else (node, neighbor)
+            )
+            for node, neighbors in graph.items()
+            for neighbor in neighbors
+        )
+        return cls.from_edges(edges, nodes=graph)
+
+    @classmethod
+    def from_edges(cls, edges, nodes=()):
+        """
+        `(始点, 終点)`または`(始点, 終点, 重み)`の組を順に読み込んで作成する。
+
+        辺はIDの`array`にだけ保持し、計数ソートで始点ごとにまとめるため、
+        途中で隣接リストの辞書を作らずに大きなグラフを読み込める。
+        同じ始点を持つ辺の順序は入力の順序のまま保たれる。
+        """
+        index = {}
+        labels = []
+
+        def node_id(label):
+            if label not in index:
+                index[label] = len(labels)
+                labels.append(label)
+            return index[label]
+
+        for node in nodes:
+            node_id(node)
+        sources = array("i")
+        targets = array("i")
+        edge_weights = array("d")
+        weighted = False
+        for source, target, *weight in edges:
+            sources.append(node_id(source))
+            targets.append(node_id(target))
+            edge_weights.append(weight[0] if weight else 1)
+            weighted = weighted or bool(weight)
+
+        offsets = array("q", [0]) * (len(labels) + 1)
+        for source in sources:
+            offsets[source + 1] += 1
+        for i in range(len(labels)):
+            offsets[i + 1] += offsets[i]
+
+        neighbors = array("i", [0]) * len(targets)
+        weights = array("d", [0]) * len(targets) if weighted else None
+        position = offsets[:-1]
+        for edge, (source, target) in enumerate(zip(sources, targets)):
+            neighbors[position[source]] = target
+            if weighted:
+                weights[position[source]] = edge_weights[edge]
+            position[source] += 1
+        return cls(labels, offsets, neighbors, weights)
+
+    def transpose(self):
+        """すべての辺の向きを逆にしたCSRグラフを作成する。ノードのIDは変わらない"""
+        offsets = self.offsets
+        neighbors = self.neighbors
+        weights = self.weights
+        size = len(self.labels)
+
+        reverse_offsets = array("q", [0]) * (size + 1)
+        for target in neighbors:
+            reverse_offsets[target + 1] += 1
+        for i in range(size):
+            reverse_offsets[i + 1] += reverse_offsets[i]
+
+        reverse_neighbors = array("i", [0]) * len(neighbors)
+        reverse_weights = None if weights is None else array("d", [0]) * len(weights)
+        position = reverse_offsets[:-1]
+        for source in range(size):
+            for edge in range(offsets[source], offsets[source + 1]):
+                target = neighbors[edge]
+                reverse_neighbors[position[target]] = source
+                if weights is not None:
+                    reverse_weights[position[target]] = weights[edge]
+                position[target] += 1
+        return type(self)(
+            self.labels, reverse_offsets, reverse_neighbors, reverse_weights
+        )
+
+    def neighbor_ids(self, node_id):
+        begin, stop = self.offsets[node_id], self.offsets[node_id + 1]
+        return self.neighbors[begin:stop]
+
+    def __getitem__(self, label):
+        labels = self.labels
+        node_id = self.index[label]
+        if self.weights is None:
+            return [labels[i] for i in self.neighbor_ids(node_id)]
+        begin, stop = self.offsets[node_id], self.offsets[node_id + 1]
+        return {labels[self.neighbors[i]]: self.weights[i] for i in range(begin, stop)}
+
+    def __iter__(self):
+        return iter(self.labels)
+
+    def __len__(self):
+        return len(self.labels)
+
+
 class GraphSearch:
 
     """Pythonでのグラフ検索エミュレーション
     http://www.python.org/doc/essays/graphs/
 
     dfsはDepth First Searchの略
-    bfsはBreadth First Searchの略"""
+    bfsはBreadth First Searchの略
+
+    開始ノードごとの幅優先探索の結果（親の辞書）は、最大`cache_size`件まで
+    LRUでキャッシュされる。`graph`を直接書き換えた場合は`clear_cache()`を
+    呼ぶこと。`add_edge()`と`remove_edge()`は自動でキャッシュを破棄する。"""
 
-    def __init__(self, graph):
+    def __init__(self, graph, cache_size=128):
         self.graph = graph
+        self.cache_size = cache_size
+        self._reverse_graph = None
+        self._parent_trees = OrderedDict()
+
+    def add_edge(self, node, neighbor, weight=1):
+        """
+        辺を追加し、キャッシュを破棄する。
+
+        新しいノードの隣接ノードは、グラフの既存の値と同じ形（重み付きなら辞書、
+        そうでなければリスト）で作成する。CSRGraphは読み取り専用なのでTypeErrorになる。
+        """
+        self._check_mutable()
+        if node not in self.graph:
+            sample = next(iter(self.graph.values()), None)
+            self.graph[node] = {} if isinstance(sample, Mapping) else []
+        neighbors = self.graph[node]
+        if isinstance(neighbors, Mapping):
+            neighbors[neighbor] = weight
+        else:
+            neighbors.append(neighbor)
+        self.clear_cache()
+
+    def remove_edge(self, node, neighbor):
+        """辺を削除し、キャッシュを破棄する"""
+        self._check_mutable()
+        neighbors = self.graph[node]
+        if isinstance(neighbors, Mapping):
+            del neighbors[neighbor]
+        else:
+            neighbors.remove(neighbor)
+        self.clear_cache()
+
+    def clear_cache(self):
+        self._reverse_graph = None
+        self._parent_trees.clear()
+
+    def _check_mutable(self):
+        if isinstance(self.graph, CSRGraph):
+            raise TypeError("CSRGraph is read-only; rebuild it to change edges")
 
     def find_path_dfs(self, start, end, path=None):
+        if path is None and isinstance(self.graph, CSRGraph):
+            # CSRグラフではIDで探索する、同じ結果の反復版を使う
+            return self.find_path_dfs_iterative(start, end)
         path = path or []
 
         path.append(start)
@@ -22,6 +202,8 @@ class GraphSearch:
                     return newpath
 
     def find_all_paths_dfs(self, start, end, path=None):
+        if path is None and isinstance(self.graph, CSRGraph):
+            return self.find_all_paths_dfs_iterative(start, end)
         path = path or []
         path.append(start)
         if start == end:
@@ -34,6 +216,8 @@ class GraphSearch:
         return paths
 
     def find_shortest_path_dfs(self, start, end, path=None):
+        if path is None and isinstance(self.graph, CSRGraph):
+            return self.find_shortest_path_dfs_iterative(start, end)
         path = path or []
         path.append(start)
 
@@ -48,6 +232,197 @@ class GraphSearch:
                         shortest = newpath
         return shortest
 
+    def find_path_dfs_iterative(self, start, end):
+        """
+        `find_path_dfs`と同じ結果を返す、再帰を使わない深さ優先探索。
+
+        再帰の代わりに隣接ノードのイテレーターを明示的なスタックに積み、
+        経路は1つのリストを共有して追加・削除する。経路上のノードは集合で
+        管理するため、`node not in path`のような線形探索も発生しない。
+        """
+        return next(self._iter_paths_dfs(start, end), None)
+
+    def find_all_paths_dfs_iterative(self, start, end):
+        """`find_all_paths_dfs`と同じ結果を返す、再帰を使わない深さ優先探索"""
+        return list(self._iter_paths_dfs(start, end))
+
+    def find_shortest_path_dfs_iterative(self, start, end):
+        """
+        `find_shortest_path_dfs`と同じ結果を返す、再帰を使わない深さ優先探索。
+
+        既に見つかった経路より長くなる枝は探索しない。
+        """
+        if start == end:
+            return [start]
+        traversal = self._traversal(start, end)
+        if traversal is None:
+            return None
+        neighbors, start, end = traversal
+
+        shortest = None
+        path = [start]
+        on_path = {start}
+        stack = [iter(neighbors(start))]
+        while stack:
+            for node in stack[-1]:
+                if node in on_path:
+                    continue
+                if shortest is not None and len(path) + 1 >= len(shortest):
+                    continue
+                if node == end:
+                    shortest = path + [node]
+                    continue
+                path.append(node)
+                on_path.add(node)
+                stack.append(iter(neighbors(node)))
+                break
+            else:
+                stack.pop()
+                on_path.discard(path.pop())
+        return None if shortest is None else self._labels(shortest)
+
+    def iter_all_paths(self, start, end, max_paths=None, max_depth=None, deadline=None):
+        """
+        `find_all_paths_dfs`と同じ順序で、経路を1つずつ生成するジェネレーター。
+
+        すべての経路をメモリ上に保持しないため、密なグラフでも途中で
+        打ち切りながら結果を順に処理できる。
+
+        :param max_paths: 生成する経路の最大数
+        :param max_depth: 経路に含まれる辺の最大数。これより長い経路は探索しない
+        :param deadline: `time.monotonic()`の値で表した探索の締め切り。
+        この時刻を過ぎると、それ以上の経路を生成せずに終了する
+        """
+        paths = self._iter_paths_dfs(start, end, max_depth, deadline)
+        yield from islice(paths, max_paths)
+
+    def _iter_paths_dfs(self, start, end, max_depth=None, deadline=None):
+        """
+        `start`から`end`までの経路を深さ優先の順で生成する。
+
+        探索中は1つのリストを共有して書き換え、見つかった経路だけを
+        ラベルのリストにコピーして返す。CSRグラフではノードのIDで探索する。
+        """
+        if start == end:
+            yield [start]
+            return
+
+        if max_depth is not None and max_depth < 1:
+            return
+        traversal = self._traversal(start, end)
+        if traversal is None:
+            return
+        neighbors, start, end = traversal
+
+        path = [start]
+        on_path = {start}
+        stack = [iter(neighbors(start))]
+        while stack:
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            for node in stack[-1]:
+                if node in on_path:
+                    continue
+                path.append(node)
+                if node == end:
+                    yield self._labels(path)
+                elif max_depth is None or len(path) <= max_depth:
+                    # さらに辺を伸ばせる場合だけ、このノードの先を探索する
+                    on_path.add(node)
+                    stack.append(iter(neighbors(node)))
+                    break
+                path.pop()
+            else:
+                stack.pop()
+                on_path.discard(path.pop())
+
+    def find_shortest_path_dijkstra(self, start, end):
+        """
+        ダイクストラ法で、辺の重みの合計が最小になる経路を検索する。
+
+        重み付きのグラフは`{ノード: {隣接ノード: 重み}}`の形で渡す。
+        隣接リストの場合は、すべての辺の重みを1として扱う。
+        重みは負でない数値であること。
+        """
+        return self.find_shortest_path_astar(start, end)
+
+    def find_shortest_path_astar(self, start, end, heuristic=None):
+        """
+        A*アルゴリズムで、辺の重みの合計が最小になる経路を検索する。
+
+        :param heuristic: `heuristic(node, end)`で`node`から`end`までの
+        残りコストの推定値を返す関数。実際のコストを超えない推定値なら
+        最短経路が得られる。省略した場合はダイクストラ法と同じになる。
+        """
+        if heuristic is None:
+            heuristic = lambda node, end: 0
+        if isinstance(self.graph, CSRGraph):
+            return self._find_shortest_path_astar_csr(start, end, heuristic)
+
+        # 同じ優先度のノード同士を比較しないよう、連番を挟む
+        tie_breaker = count()
+        dist_to = {start: 0}
+        parent = {start: None}
+        heap = [(heuristic(start, end), next(tie_breaker), 0, start)]
+        while heap:
+            _, _, dist, value = heappop(heap)
+            if value == end:
+                return self._build_path(parent, end)
+            if dist > dist_to[value]:
+                # より短い経路で更新済みの古いエントリー
+                continue
+            for node, weight in self._weighted_neighbors(value):
+                new_dist = dist + weight
+                if node not in dist_to or new_dist < dist_to[node]:
+                    dist_to[node] = new_dist
+                    parent[node] = value
+                    priority = new_dist + heuristic(node, end)
+                    heappush(heap, (priority, next(tie_breaker), new_dist, node))
+        return None
+
+    def _find_shortest_path_astar_csr(self, start, end, heuristic):
+        """CSRグラフ上で、距離と親を配列に持ってA*を行う"""
+        if start == end:
+            return [start]
+        graph = self.graph
+        if start not in graph.index or end not in graph.index:
+            return None
+        source = graph.index[start]
+        target = graph.index[end]
+        labels = graph.labels
+        offsets = graph.offsets
+        neighbors = graph.neighbors
+        weights = graph.weights
+
+        tie_breaker = count()
+        dist_to = array("d", [float("inf")]) * len(graph)
+        parent = array("i", [-1]) * len(graph)
+        dist_to[source] = 0
+        parent[source] = source
+        heap = [(heuristic(start, end), next(tie_breaker), 0, source)]
+        while heap:
+            _, _, dist, value = heappop(heap)
+            if value == target:
+                return _build_path_ids(graph, parent, source, target)
+            if dist > dist_to[value]:
+                continue
+            for edge in range(offsets[value], offsets[value + 1]):
+                node = neighbors[edge]
+                new_dist = dist + (1 if weights is None else weights[edge])
+                if new_dist < dist_to[node]:
+                    dist_to[node] = new_dist
+                    parent[node] = value
+                    priority = new_dist + heuristic(labels[node], end)
+                    heappush(heap, (priority, next(tie_breaker), new_dist, node))
+        return None
+
+    def _weighted_neighbors(self, node):
+        """`(隣接ノード, 重み)`の組を返す"""
+        neighbors = self.graph.get(node, [])
+        if isinstance(neighbors, Mapping):
+            return neighbors.items()
+        return ((neighbor, 1) for neighbor in neighbors)
+
     def find_shortest_path_bfs(self, start, end):
         """
         幅優先探索を使用して、グラフ内の2つのノード間の最短経路を検索する。
@@ -57,33 +432,371 @@ class GraphSearch:
         :param end: 最短経路を見つけるノード
         :type end: str または int
 
-        :returns queue_path_to_end, dist_to[end]: `start`から`end`までの
-        最短経路を表すノードのリスト、およびグラフ内の各ノード（`start`を除く）
-        とそのノードからの距離（ホップ数）をマッピングする辞書。
-        そのようなパスが存在しない場合は、代わりに空のリストと空の辞書を返す。
-        """
-        queue = [start]
-        dist_to = {start: 0}
-        edge_to = {}
+        :returns path: `start`から`end`までの最短経路を表すノードのリスト。
+        そのようなパスが存在しない場合は、代わりにNoneを返す。
 
+        フロンティアにはdequeを使い、各ノードの親だけを記録する。
+        `end`を発見した時点で探索を打ち切り（early exit）、経路は親を
+        たどって逆順に組み立ててから反転するため、全体でO(V + E)になる。
+        """
         if start == end:
-            return queue
-
-        while len(queue):
-            value = queue.pop(0)
-            for node in self.graph[value]:
-                if node not in dist_to.keys():
-                    edge_to[node] = value
-                    dist_to[node] = dist_to[value] + 1
+            return [start]
+        if isinstance(self.graph, CSRGraph):
+            return self._find_shortest_path_bfs_csr(start, end)
+
+        parent = {start: None}
+        queue = deque([start])
+        while queue:
+            value = queue.popleft()
+            for node in self.graph.get(value, []):
+                if node not in parent:
+                    parent[node] = value
+                    if node == end:
+                        return self._build_path(parent, end)
+                    queue.append(node)
+        return None
+
+    def find_shortest_paths_bfs(self, start, ends):
+        """
+        `start`から複数のノードまでの最短経路を、1回の幅優先探索でまとめて求める。
+
+        :returns paths: `ends`の各ノードをキーとし、`find_shortest_path_bfs`と
+        同じ経路（到達できない場合はNone）を値とする辞書
+        """
+        graph = self.graph
+        if isinstance(graph, CSRGraph):
+            if start not in graph.index:
+                return {end: [start] if end == start else None for end in ends}
+            source = graph.index[start]
+            parent, _ = self._parent_tree(start)
+            paths = {}
+            for end in ends:
+                target = graph.index.get(end)
+                reachable = target is not None and parent[target] != -1
+                paths[end] = (
+                    _build_path_ids(graph, parent, source, target)
+                    if reachable
+                    else None
+                )
+            return paths
+
+        parent = self._parent_tree(start)
+        return {
+            end: self._build_path(parent, end) if end in parent else None
+            for end in ends
+        }
+
+    def all_pairs_shortest_paths(self, processes=None):
+        """
+        すべてのノードの組について、幅優先探索で最短経路を求める。
+
+        :param processes: 指定した場合は、その数のプロセスで開始ノードごとの
+        探索を並列に実行する
+        :returns paths: `{開始ノード: {到達可能なノード: 経路}}`の辞書
+        """
+        sources = list(self.graph)
+        if processes is None:
+            trees = [self._parent_tree(source) for source in sources]
+        else:
+            with ProcessPoolExecutor(
+                max_workers=processes,
+                initializer=_set_worker_graph,
+                initargs=(self.graph,),
+            ) as executor:
+                trees = list(executor.map(_worker_bfs_parents, sources))
+        graph = self.graph
+        if isinstance(graph, CSRGraph):
+            return {
+                source: {
+                    graph.labels[target]: _build_path_ids(
+                        graph, parent, graph.index[source], target
+                    )
+                    for target in order
+                }
+                for source, (parent, order) in zip(sources, trees)
+            }
+        return {
+            source: {end: self._build_path(parent, end) for end in parent}
+            for source, parent in zip(sources, trees)
+        }
+
+    def _parent_tree(self, start):
+        """
+        `start`からの幅優先探索の親の辞書を、LRUキャッシュを通して返す。
+        CSRグラフでは親のIDの配列と、訪問したIDの配列の組になる。
+        """
+        trees = self._parent_trees
+        if start in trees:
+            trees.move_to_end(start)
+            return trees[start]
+        parent = _bfs_parents(self.graph, start)
+        if self.cache_size > 0:
+            trees[start] = parent
+            if len(trees) > self.cache_size:
+                trees.popitem(last=False)
+        return parent
+
+    def _find_shortest_path_bfs_csr(self, start, end):
+        """CSRグラフ上で、整数IDと親の配列を使って幅優先探索を行う"""
+        graph = self.graph
+        if start not in graph.index or end not in graph.index:
+            return None
+        source = graph.index[start]
+        target = graph.index[end]
+        offsets = graph.offsets
+        neighbors = graph.neighbors
+
+        # -1は未訪問を表す
+        parent = array("i", [-1]) * len(graph)
+        parent[source] = source
+        queue = deque([source])
+        while queue:
+            value = queue.popleft()
+            begin, stop = offsets[value], offsets[value + 1]
+            for node in neighbors[begin:stop]:
+                if parent[node] == -1:
+                    parent[node] = value
+                    if node == target:
+                        return _build_path_ids(graph, parent, source, target)
                     queue.append(node)
-                    if end in edge_to.keys():
-                        path = []
-                        node = end
-                        while dist_to[node] != 0:
-                            path.insert(0, node)
-                            node = edge_to[node]
-                        path.insert(0, start)
-                        return path
+        return None
+
+    def find_shortest_path_bidirectional_bfs(self, start, end):
+        """
+        `start`と`end`の両側から同時に幅優先探索を行い、最短経路を検索する。
+
+        探索するノード数は片側BFSのおよそ平方根程度で済むが、
+        同じ長さの最短経路が複数ある場合は`find_shortest_path_bfs`と
+        異なる経路を返すことがある。有向グラフの逆向き探索には
+        `graph`から作った逆隣接リストを使う（初回呼び出し時に作成される）。
+        """
+        if start == end:
+            return [start]
+        if isinstance(self.graph, CSRGraph):
+            return self._find_shortest_path_bidirectional_bfs_csr(start, end)
+
+        predecessors = self._predecessors()
+        forward = {start: None}
+        backward = {end: None}
+        forward_depth = {start: 0}
+        backward_depth = {end: 0}
+        forward_frontier = [start]
+        backward_frontier = [end]
+
+        while forward_frontier and backward_frontier:
+            # 小さい方のフロンティアを1レベル分だけ展開する
+            if len(forward_frontier) <= len(backward_frontier):
+                forward_frontier, meet = self._expand_level(
+                    forward_frontier,
+                    self.graph,
+                    forward,
+                    forward_depth,
+                    backward_depth,
+                )
+            else:
+                backward_frontier, meet = self._expand_level(
+                    backward_frontier,
+                    predecessors,
+                    backward,
+                    backward_depth,
+                    forward_depth,
+                )
+            if meet is not None:
+                path = self._build_path(forward, meet)
+                node = backward[meet]
+                while node is not None:
+                    path.append(node)
+                    node = backward[node]
+                return path
+        return None
+
+    @staticmethod
+    def _expand_level(frontier, graph, parent, depth, other_depth):
+        """フロンティアを1レベル展開し、反対側と出会った最良のノードを返す"""
+        next_frontier = []
+        meet = None
+        for value in frontier:
+            for node in graph.get(value, []):
+                if node in parent:
+                    continue
+                parent[node] = value
+                depth[node] = depth[value] + 1
+                next_frontier.append(node)
+                if node in other_depth and (
+                    meet is None or other_depth[node] < other_depth[meet]
+                ):
+                    meet = node
+        return next_frontier, meet
+
+    def _find_shortest_path_bidirectional_bfs_csr(self, start, end):
+        """CSRグラフ上で、親と深さを配列に持って両側から幅優先探索を行う"""
+        graph = self.graph
+        if start not in graph.index or end not in graph.index:
+            return None
+        source = graph.index[start]
+        target = graph.index[end]
+        reverse = self._predecessors()
+
+        # 深さが-1のノードは未訪問
+        forward = array("i", [-1]) * len(graph)
+        backward = array("i", [-1]) * len(graph)
+        forward_depth = array("i", [-1]) * len(graph)
+        backward_depth = array("i", [-1]) * len(graph)
+        forward[source] = source
+        backward[target] = target
+        forward_depth[source] = 0
+        backward_depth[target] = 0
+        forward_frontier = [source]
+        backward_frontier = [target]
+
+        while forward_frontier and backward_frontier:
+            if len(forward_frontier) <= len(backward_frontier):
+                forward_frontier, meet = self._expand_level_ids(
+                    forward_frontier, graph, forward, forward_depth, backward_depth
+                )
+            else:
+                backward_frontier, meet = self._expand_level_ids(
+                    backward_frontier, reverse, backward, backward_depth, forward_depth
+                )
+            if meet is not None:
+                path = _build_path_ids(graph, forward, source, meet)
+                node = meet
+                while node != target:
+                    node = backward[node]
+                    path.append(graph.labels[node])
+                return path
+        return None
+
+    @staticmethod
+    def _expand_level_ids(frontier, graph, parent, depth, other_depth):
+        """`_expand_level`のCSR版。ノードはIDで、親と深さは配列で表す"""
+        offsets = graph.offsets
+        neighbors = graph.neighbors
+        next_frontier = []
+        meet = None
+        for value in frontier:
+            begin, stop = offsets[value], offsets[value + 1]
+            for node in neighbors[begin:stop]:
+                if depth[node] != -1:
+                    continue
+                parent[node] = value
+                depth[node] = depth[value] + 1
+                next_frontier.append(node)
+                if other_depth[node] != -1 and (
+                    meet is None or other_depth[node] < other_depth[meet]
+                ):
+                    meet = node
+        return next_frontier, meet
+
+    def _traversal(self, start, end):
+        """
+        探索に使う`(隣接ノードを返す関数, 開始ノード, 終了ノード)`を返す。
+
+        CSRグラフではラベルをIDに変換し、`neighbor_ids`でIDの配列を直接たどる。
+        どちらかのノードがCSRグラフに存在しない場合は、経路がないのでNoneを返す。
+        """
+        graph = self.graph
+        if isinstance(graph, CSRGraph):
+            if start not in graph.index or end not in graph.index:
+                return None
+            return graph.neighbor_ids, graph.index[start], graph.index[end]
+        return (lambda node: graph.get(node, [])), start, end
+
+    def _labels(self, path):
+        """探索中の経路を、ラベルのリストにコピーする"""
+        if isinstance(self.graph, CSRGraph):
+            labels = self.graph.labels
+            return [labels[node] for node in path]
+        return list(path)
+
+    def _predecessors(self):
+        """
+        逆向きの隣接リストを作成してキャッシュする。
+        CSRグラフでは、辺の向きを逆にしたCSRグラフになる。
+        """
+        if self._reverse_graph is None and isinstance(self.graph, CSRGraph):
+            self._reverse_graph = self.graph.transpose()
+        if self._reverse_graph is None:
+            reverse_graph = {}
+            for node, neighbors in self.graph.items():
+                for neighbor in neighbors:
+                    reverse_graph.setdefault(neighbor, []).append(node)
+            self._reverse_graph = reverse_graph
+        return self._reverse_graph
+
+    @staticmethod
+    def _build_path(parent, end):
+        """親の辞書をたどって`end`までの経路を組み立てる"""
+        path = []
+        node = end
+        while node is not None:
+            path.append(node)
+            node = parent[node]
+        path.reverse()
+        return path
+
+
+def _build_path_ids(graph, parent, source, target):
+    """親のIDの配列をたどって、`source`から`target`までのラベルの経路を組み立てる"""
+    labels = graph.labels
+    node = target
+    path = [labels[node]]
+    while node != source:
+        node = parent[node]
+        path.append(labels[node])
+    path.reverse()
+    return path
+
+
+def _bfs_parent_ids(graph, source):
+    """
+    CSRグラフ上の幅優先探索で、親のIDの配列（未到達は-1）と訪問した順のIDの配列を求める。
+
+    訪問した順の配列は、そのままキューとしても使う。
+    """
+    offsets = graph.offsets
+    neighbors = graph.neighbors
+    parent = array("i", [-1]) * len(graph)
+    parent[source] = source
+    order = array("i", [source])
+    head = 0
+    while head < len(order):
+        value = order[head]
+        head += 1
+        begin, stop = offsets[value], offsets[value + 1]
+        for node in neighbors[begin:stop]:
+            if parent[node] == -1:
+                parent[node] = value
+                order.append(node)
+    return parent, order
+
+
+def _bfs_parents(graph, start):
+    """`start`から到達できるすべてのノードについて、幅優先探索の親を求める"""
+    if isinstance(graph, CSRGraph):
+        return _bfs_parent_ids(graph, graph.index[start])
+    parent = {start: None}
+    queue = deque([start])
+    while queue:
+        value = queue.popleft()
+        for node in graph.get(value, []):
+            if node not in parent:
+                parent[node] = value
+                queue.append(node)
+    return parent
+
+
+# プロセスプールの各ワーカーが、一度だけ受け取ったグラフを保持する
+_worker_graph = None
+
+
+def _set_worker_graph(graph):
+    global _worker_graph
+    _worker_graph = graph
+
+
+def _worker_bfs_parents(start):
+    return _bfs_parents(_worker_graph, start)
 
 
 def main():
@@ -125,6 +838,25 @@ def main():
     >>> print(graph_search.find_shortest_path_dfs('A', 'F'))
     ['A', 'C', 'G', 'E', 'F']
 
+    # 再帰を使わない深さ優先探索も同じ結果を返す
+    >>> print(graph_search.find_path_dfs_iterative('A', 'D'))
+    ['A', 'B', 'C', 'D']
+    >>> print(graph_search.find_path_dfs_iterative('C', 'H'))
+    None
+    >>> print(graph_search.find_all_paths_dfs_iterative('A', 'D'))
+    [['A', 'B', 'C', 'D'], ['A', 'B', 'D'], ['A', 'C', 'D']]
+    >>> print(graph_search.find_shortest_path_dfs_iterative('A', 'F'))
+    ['A', 'C', 'G', 'E', 'F']
+
+    # 経路を1つずつ生成し、条件に応じて途中で打ち切る
+    >>> paths = graph_search.iter_all_paths('A', 'D')
+    >>> print(next(paths))
+    ['A', 'B', 'C', 'D']
+    >>> print(list(graph_search.iter_all_paths('A', 'D', max_paths=2)))
+    [['A', 'B', 'C', 'D'], ['A', 'B', 'D']]
+    >>> print(list(graph_search.iter_all_paths('A', 'D', max_depth=2)))
+    [['A', 'B', 'D'], ['A', 'C', 'D']]
+
     >>> print(graph_search.find_shortest_path_bfs('A', 'D'))
     ['A', 'B', 'D']
     >>> print(graph_search.find_shortest_path_bfs('A', 'F'))
@@ -141,6 +873,96 @@ def main():
     # 存在しないノード
     >>> print(graph_search.find_shortest_path_bfs('A', 'X'))
     None
+
+    # 同じ開始ノードから複数のノードへの経路をまとめて求める
+    >>> paths = graph_search.find_shortest_paths_bfs('A', ['D', 'F', 'H'])
+    >>> print(paths['D'], paths['F'], paths['H'])
+    ['A', 'B', 'D'] ['A', 'C', 'G', 'E', 'F'] None
+    >>> print(graph_search.all_pairs_shortest_paths()['G'])
+    {'G': ['G'], 'E': ['G', 'E'], 'F': ['G', 'E', 'F'], 'C': ['G', 'E', 'F', 'C'], 'D': ['G', 'E', 'F', 'C', 'D']}
+
+    # グラフを変更するとキャッシュが破棄される
+    >>> graph_search.add_edge('A', 'F')
+    >>> print(graph_search.find_shortest_paths_bfs('A', ['F'])['F'])
+    ['A', 'F']
+    >>> graph_search.remove_edge('A', 'F')
+    >>> print(graph_search.find_shortest_paths_bfs('A', ['F'])['F'])
+    ['A', 'C', 'G', 'E', 'F']
+
+    # 両側から探索する
+    >>> print(graph_search.find_shortest_path_bidirectional_bfs('A', 'F'))
+    ['A', 'C', 'G', 'E', 'F']
+    >>> print(graph_search.find_shortest_path_bidirectional_bfs('A', 'H'))
+    None
+
+    # 重み付きのグラフで、重みの合計が最小の経路を検索する
+    >>> weighted_graph = {
+    ...     'A': {'B': 1, 'C': 4},
+    ...     'B': {'C': 1, 'D': 5},
+    ...     'C': {'D': 1},
+    ...     'D': {},
+    ... }
+    >>> weighted_search = GraphSearch(weighted_graph)
+    >>> print(weighted_search.find_shortest_path_dijkstra('A', 'D'))
+    ['A', 'B', 'C', 'D']
+    >>> print(weighted_search.find_shortest_path_bfs('A', 'D'))
+    ['A', 'B', 'D']
+
+    # 重み付きのグラフに新しいノードから辺を追加しても、重みは保たれる
+    >>> weighted_search.add_edge('E', 'A', 7)
+    >>> weighted_graph['E']
+    {'A': 7}
+    >>> weighted_search.remove_edge('E', 'A')
+    >>> del weighted_graph['E']
+
+    # 推定コストを与えてA*で検索する
+    >>> estimate = {'A': 3, 'B': 2, 'C': 1, 'D': 0}
+    >>> print(weighted_search.find_shortest_path_astar(
+    ...     'A', 'D', heuristic=lambda node, end: estimate[node]))
+    ['A', 'B', 'C', 'D']
+    >>> print(weighted_search.find_shortest_path_dijkstra('D', 'A'))
+    None
+
+    # 重みのないグラフでは、すべての辺の重みを1として扱う
+    >>> print(graph_search.find_shortest_path_dijkstra('A', 'F'))
+    ['A', 'C', 'G', 'E', 'F']
+
+    # CSR形式のグラフでも同じように検索できる
+    >>> csr_search = GraphSearch(CSRGraph.from_dict(graph))
+    >>> print(csr_search.find_shortest_path_bfs('A', 'F'))
+    ['A', 'C', 'G', 'E', 'F']
+    >>> print(csr_search.find_shortest_path_bfs('A', 'X'))
+    None
+    >>> print(csr_search.find_all_paths_dfs('A', 'D'))
+    [['A', 'B', 'C', 'D'], ['A', 'B', 'D'], ['A', 'C', 'D']]
+    >>> print(csr_search.find_shortest_path_bidirectional_bfs('G', 'F'))
+    ['G', 'E', 'F']
+    >>> print(list(csr_search.iter_all_paths('A', 'D', max_depth=2)))
+    [['A', 'B', 'D'], ['A', 'C', 'D']]
+    >>> paths = csr_search.find_shortest_paths_bfs('A', ['D', 'F', 'H'])
+    >>> print(paths['D'], paths['F'], paths['H'])
+    ['A', 'B', 'D'] ['A', 'C', 'G', 'E', 'F'] None
+    >>> print(csr_search.all_pairs_shortest_paths()['G'])
+    {'G': ['G'], 'E': ['G', 'E'], 'F': ['G', 'E', 'F'], 'C': ['G', 'E', 'F', 'C'], 'D': ['G', 'E', 'F', 'C', 'D']}
+
+    # 逆向きの探索には、辺の向きを逆にしたCSRグラフを使う
+    >>> type(csr_search._predecessors()).__name__
+    'CSRGraph'
+    >>> csr_search._predecessors()['C']
+    ['A', 'B', 'D', 'F', 'H']
+
+    # CSRグラフは読み取り専用
+    >>> csr_search.add_edge('A', 'F')
+    Traceback (most recent call last):
+    ...
+    TypeError: CSRGraph is read-only; rebuild it to change edges
+
+    >>> csr_weighted = GraphSearch(CSRGraph.from_dict(weighted_graph))
+    >>> print(csr_weighted.find_shortest_path_dijkstra('A', 'D'))
+    ['A', 'B', 'C', 'D']
+    >>> print(csr_weighted.find_shortest_path_astar(
+    ...     'A', 'D', heuristic=lambda node, end: estimate[node]))
+    ['A', 'B', 'C', 'D']
     """
 
 
@@ -25,26 +25,94 @@ https://docs.python.org/3/library/sys.html#sys.intern
 他の同様のオブジェクトとデータを共有することにより、メモリ使用量を最小限に抑える。
 """
 
+import sys
+import threading
 import weakref
+from collections import OrderedDict
+
+
+class FlyweightPool:
+    """
+    スレッドセーフなオブジェクトプール
+
+    WeakValueDictionaryを使用するので、他に参照がないオブジェクトはガベージコレクションで
+    回収される。キーのハッシュ値で選んだロック(ロックストライピング)の中で確認と追加を
+    行うので、複数のスレッドから同時に作成しても同じキーのオブジェクトは1つだけになる。
+
+    max_strongを指定すると、最近使われたオブジェクトをその数まで強参照で保持し続ける。
+    """
+
+    def __init__(self, stripes=16, max_strong=0):
+        self.max_strong = max_strong
+        self._weak = weakref.WeakValueDictionary()
+        # 作成中に同じスレッドから別のFlyweightを作ることがあるので、RLockにする
+        self._stripes = [threading.RLock() for _ in range(stripes)]
+        # ストライプごとの[ヒット数, ミス数]
+        self._counts = [[0, 0] for _ in range(stripes)]
+        self._strong = OrderedDict()
+        self._strong_lock = threading.Lock()
+        self._evictions = 0
+
+    def get(self, key, factory, *args, **kwargs):
+        """keyのオブジェクトを返す。無ければfactory(*args, **kwargs)で作成して追加する"""
+        stripe = hash(key) % len(self._stripes)
+        with self._stripes[stripe]:
+            obj = self._weak.get(key)
+            if obj is None:
+                self._counts[stripe][1] += 1
+                obj = self._weak[key] = factory(*args, **kwargs)
+            else:
+                self._counts[stripe][0] += 1
+        if self.max_strong:
+            self._keep(key, obj)
+        return obj
+
+    def _keep(self, key, obj):
+        with self._strong_lock:
+            strong = self._strong
+            strong[key] = obj
+            strong.move_to_end(key)
+            while len(strong) > self.max_strong:
+                strong.popitem(last=False)
+                self._evictions += 1
+
+    def clear(self):
+        with self._strong_lock:
+            self._strong.clear()
+        self._weak.clear()
+
+    def __len__(self):
+        return len(self._weak)
+
+    def stats(self):
+        """ヒット数、ミス数、強参照から外した数、現在の数を辞書で返す"""
+        with self._strong_lock:
+            evictions, strong = self._evictions, len(self._strong)
+        return {
+            "hits": sum(hits for hits, _ in self._counts),
+            "misses": sum(misses for _, misses in self._counts),
+            "evictions": evictions,
+            "size": len(self._weak),
+            "strong": strong,
+        }
 
 
 class Card:
     """Flyweightとなるクラス"""
 
-    # シンプルな辞書であるべき。
-    # WeakValueDictionaryを使用すると、ガベージコレクションは、他に参照がない場合に
-    # オブジェクトを再利用できる。
-    _pool: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+    # 他に参照がないオブジェクトは、ガベージコレクションで回収される
+    _pool = FlyweightPool()
 
     def __new__(cls, value, suit):
         # オブジェクトがプールに存在する場合 - それを返す
-        obj = cls._pool.get(value + suit)
         # それ以外の場合 - 新しいオブジェクトを作成する（そしてそれをプールに追加する）
-        if obj is None:
-            obj = object.__new__(Card)
-            cls._pool[value + suit] = obj
-            # この行は、通常`__init__`で見られる部分を実行する
-            obj.value, obj.suit = value, suit
+        return cls._pool.get(value + suit, cls._create, value, suit)
+
+    @staticmethod
+    def _create(value, suit):
+        obj = object.__new__(Card)
+        # この行は、通常`__init__`で見られる部分を実行する
+        obj.value, obj.suit = value, suit
         return obj
 
     # `__init__`のコメントを外し、`__new__`をコメントアウトした場合 -
@@ -56,6 +124,85 @@ class Card:
         return f"<Card: {self.value}{self.suit}>"
 
 
+class SlottedFlyweight:
+    """
+    __slots__を使うFlyweightの基底クラス
+
+    サブクラスの__slots__に固有の状態(intrinsic state)の属性名を並べる。インスタンスは
+    __dict__を持たず、文字列の値はsys.internで共有される。作成後は変更できないので、
+    位置などの状態に依存しない値(extrinsic state)はメソッドの引数で渡すか、
+    Flyweightを参照する別の小さなオブジェクトに持たせる。
+    """
+
+    # WeakValueDictionaryのプールに入れるには、弱参照できる必要がある
+    __slots__ = ("__weakref__",)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._pool = FlyweightPool()
+        # 親クラスで宣言された属性も含め、宣言された順に並べる
+        fields = []
+        for klass in reversed(cls.__mro__):
+            slots = klass.__dict__.get("__slots__", ())
+            if isinstance(slots, str):
+                slots = (slots,)
+            fields.extend(s for s in slots if s not in ("__weakref__", "__dict__"))
+        cls._fields = tuple(fields)
+
+    def __new__(cls, *values):
+        if len(values) != len(cls._fields):
+            raise TypeError(
+                f"{cls.__name__}() takes {len(cls._fields)} arguments"
+                f" ({', '.join(cls._fields)}) but {len(values)} were given"
+            )
+        values = tuple(sys.intern(v) if type(v) is str else v for v in values)
+        # 1、True、1.0のように等しいが型が異なる値を区別するため、型もキーに含める
+        key = (values, tuple(map(type, values)))
+        return cls._pool.get(key, cls._create, values)
+
+    @classmethod
+    def _create(cls, values):
+        obj = object.__new__(cls)
+        for name, value in zip(cls._fields, values):
+            object.__setattr__(obj, name, value)
+        return obj
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __reduce__(self):
+        return type(self), tuple(getattr(self, name) for name in self._fields)
+
+
+class CompactCard(SlottedFlyweight):
+    """固有の状態である数字とマークだけを持つFlyweight"""
+
+    __slots__ = ("value", "suit")
+
+    def render(self, position):
+        # 位置は共有されない状態なので、引数で受け取る
+        return f"{self.value}{self.suit}@{position}"
+
+    def __repr__(self):
+        return f"<CompactCard: {self.value}{self.suit}>"
+
+
+class CardOnTable:
+    """共有されない状態(場所)とFlyweightへの参照だけを持つ"""
+
+    __slots__ = ("card", "position")
+
+    def __init__(self, card, position):
+        self.card = card
+        self.position = position
+
+    def render(self):
+        return self.card.render(self.position)
+
+
 def main():
     """
     >>> c1 = Card('9', 'h')
@@ -76,6 +223,65 @@ def main():
     >>> c4 = Card('9', 'h')
     >>> hasattr(c4, 'new_attr')
     False
+
+    # プールはヒット数とミス数を記録する
+    >>> Card._pool.stats()
+    {'hits': 2, 'misses': 2, 'evictions': 0, 'size': 1, 'strong': 0}
+
+    # max_strongを指定すると、使われなくなったオブジェクトも最近の分だけ保持される
+    >>> pool = FlyweightPool(max_strong=2)
+    >>> for name in ['a', 'b', 'c']:
+    ...     _ = pool.get(name, set)
+    >>> pool.stats()
+    {'hits': 0, 'misses': 3, 'evictions': 1, 'size': 2, 'strong': 2}
+
+    # __slots__のFlyweightは共有され、変更できない
+    >>> c5 = CompactCard('9', 'h')
+    >>> c5 is CompactCard('9', 'h')
+    True
+    >>> c5.new_attr = 'temp'
+    Traceback (most recent call last):
+    ...
+    AttributeError: CompactCard is immutable
+    >>> del c5.value
+    Traceback (most recent call last):
+    ...
+    AttributeError: CompactCard is immutable
+
+    # 引数の数が固有の状態の数と一致しなければエラーになる
+    >>> CompactCard('9')
+    Traceback (most recent call last):
+    ...
+    TypeError: CompactCard() takes 2 arguments (value, suit) but 1 were given
+
+    # サブクラスは親クラスの固有の状態を引き継ぐ
+    >>> class MarkedCard(CompactCard):
+    ...     __slots__ = ("mark",)
+    >>> marked = MarkedCard('9', 'h', '*')
+    >>> marked.value, marked.suit, marked.mark, marked is MarkedCard('9', 'h', '*')
+    ('9', 'h', '*', True)
+
+    # 等しくても型が異なる値は、別のFlyweightになる
+    >>> MarkedCard('9', 'h', 1) is MarkedCard('9', 'h', True)
+    False
+
+    # 共有されない状態は別のオブジェクトに持たせる
+    >>> table = [CardOnTable(c5, position) for position in range(3)]
+    >>> [placed.render() for placed in table]
+    ['9h@0', '9h@1', '9h@2']
+
+    # __dict__を持たないので、カード1枚あたりのメモリはCardより小さい
+    >>> hasattr(c1, '__dict__'), hasattr(c5, '__dict__')
+    (True, False)
+
+    # 場所ごとのオブジェクトは、1つあたり数十バイトで済む(tracemallocで計測する)
+    >>> import tracemalloc
+    >>> positions = list(range(10000))
+    >>> tracemalloc.start()
+    >>> table = [CardOnTable(c5, position) for position in positions]
+    >>> tracemalloc.get_traced_memory()[0] // len(table) < 64
+    True
+    >>> tracemalloc.stop()
     """
 
 
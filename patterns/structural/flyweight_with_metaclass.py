@@ -1,39 +1,97 @@
+import threading
 import weakref
+from collections import OrderedDict
+
+
+class _Pool:
+    """
+    メタクラスの例で使う、最小限のスレッドセーフなオブジェクトプール
+
+    ロックストライピングや統計を持つ完全なものはflyweight.pyのFlyweightPoolを参照。
+    max_strongを指定すると、最近使われたオブジェクトをその数まで強参照で保持し続ける。
+    """
+
+    def __init__(self, max_strong=0):
+        self.max_strong = max_strong
+        self.evictions = 0
+        self._weak = weakref.WeakValueDictionary()
+        self._strong = OrderedDict()
+        # 作成中に同じスレッドから別のFlyweightを作ることがあるので、RLockにする
+        self._lock = threading.RLock()
+
+    def get(self, key, factory, *args, **kwargs):
+        """keyのオブジェクトを返す。無ければfactory(*args, **kwargs)で作成して追加する"""
+        with self._lock:
+            obj = self._weak.get(key)
+            if obj is None:
+                obj = self._weak[key] = factory(*args, **kwargs)
+            if self.max_strong:
+                self._strong[key] = obj
+                self._strong.move_to_end(key)
+                while len(self._strong) > self.max_strong:
+                    self._strong.popitem(last=False)
+                    self.evictions += 1
+        return obj
+
+    def __len__(self):
+        return len(self._weak)
+
+
+def _freeze(value):
+    """値を、型と内容が同じならば等しくなるハッシュ可能な値にする"""
+    if isinstance(value, (list, tuple)):
+        return type(value), tuple(map(_freeze, value))
+    if isinstance(value, dict):
+        return type(value), frozenset((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, (set, frozenset)):
+        return type(value), frozenset(map(_freeze, value))
+    try:
+        hash(value)
+    except TypeError:
+        # bytearrayや__hash__ = Noneのクラスなどは、reprで比較する
+        return type(value), repr(value)
+    return type(value), value
 
 
 class FlyweightMeta(type):
-    def __new__(mcs, name, parents, dct):
+    def __new__(mcs, name, parents, dct, max_strong=0):
         """
         オブジェクトプールを設定する
 
         :param name: クラス名
         :param parents: 親クラス
         :param dct: dict: クラス属性、クラスメソッド、静的メソッドなどが含まれる
+        :param max_strong: 強参照で保持し続ける、最近使われたインスタンスの数
         :return: 新しいクラス
         """
-        dct["pool"] = weakref.WeakValueDictionary()
+        dct["pool"] = _Pool(max_strong=max_strong)
         return super().__new__(mcs, name, parents, dct)
 
     @staticmethod
     def _serialize_params(cls, *args, **kwargs):
         """
-        入力パラメータをキーにシリアライズする。
-        簡単な実装は、文字列としてシリアライズすること。
+        入力パラメータをハッシュ可能なキーにする。
+
+        文字列にすると1と"1"のように表示が同じ値を区別できないので、タプルをそのままキーにする。
+        1、True、1.0のように等しいが型が異なる値も区別するため、functools.lru_cache(typed=True)と
+        同じように各値の型もキーに含める。キーワード引数は渡した順番に影響されないようにソートする。
         """
-        args_list = list(map(str, args))
-        args_list.extend([str(kwargs), cls.__name__])
-        key = "".join(args_list)
+        if kwargs:
+            items = tuple(sorted(kwargs.items()))
+            types = tuple(map(type, args)) + tuple(type(v) for _, v in items)
+            key = (cls, args, items, types)
+        else:
+            key = (cls, args, tuple(map(type, args)))
+        try:
+            hash(key)
+        except TypeError:
+            # リストや辞書などのハッシュ化できない引数は、内容が等しいタプルに変換する
+            key = (cls, _freeze(args), _freeze(kwargs))
         return key
 
     def __call__(cls, *args, **kwargs):
         key = FlyweightMeta._serialize_params(cls, *args, **kwargs)
-        pool = getattr(cls, "pool", {})
-
-        instance = pool.get(key)
-        if instance is None:
-            instance = super().__call__(*args, **kwargs)
-            pool[key] = instance
-        return instance
+        return cls.pool.get(key, super().__call__, *args, **kwargs)
 
 
 class Card2(metaclass=FlyweightMeta):
@@ -60,3 +118,30 @@ if __name__ == "__main__":
 
     del cm3
     assert len(instances_pool) == 0
+
+    # 表示が同じでも異なる値は区別される
+    assert Card2(1) is not Card2("1")
+    # 等しくても型が異なる値は区別される
+    assert Card2(1) is not Card2(True) and Card2(1) is not Card2(1.0)
+    assert Card2(a=1) is not Card2(a=True)
+    # キーワード引数の順番は問わない
+    cm4 = Card2(a=1, b=2)
+    assert cm4 is Card2(b=2, a=1)
+    # ハッシュ化できない引数も内容で比較される
+    cm5 = Card2(["10", "h"], extra={"a": 1})
+    assert cm5 is Card2(["10", "h"], extra={"a": 1})
+    assert cm5 is not Card2(("10", "h"), extra={"a": 1})
+    # ハッシュ化できない、コンテナ以外の引数も使える
+    cm6 = Card2(bytearray(b"x"))
+    assert cm6 is Card2(bytearray(b"x")) and cm6 is not Card2(bytearray(b"y"))
+
+    # 最近使われたインスタンスは、参照がなくなってもプールに残る
+    class HotCard(metaclass=FlyweightMeta, max_strong=1):
+        def __init__(self, value, suit):
+            self.value, self.suit = value, suit
+
+    HotCard("A", "s")
+    assert len(HotCard.pool) == 1
+    HotCard("K", "s")
+    assert len(HotCard.pool) == 1
+    assert HotCard.pool.evictions == 1
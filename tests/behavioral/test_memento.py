@@ -0,0 +1,103 @@
+import copy
+import pickle
+
+import pytest
+
+from patterns.behavioral.memento import Document, Transaction, _write_logs
+
+
+def test_tracked_object_can_be_pickled_during_transaction():
+    document = Document("draft", "body")
+    transaction = Transaction(False, document)
+    document.title = "final"
+    restored = pickle.loads(pickle.dumps(document))
+    assert restored.__dict__ == {"title": "final", "body": "body"}
+    transaction.rollback()
+    assert document.title == "draft"
+
+
+def test_writes_to_copy_are_not_recorded_for_original():
+    document = Document("draft", "body")
+    transaction = Transaction(False, document)
+    duplicate = copy.copy(document)
+    duplicate.title = "copy"
+    assert id(duplicate) not in _write_logs
+    transaction.rollback()
+    assert document.title == "draft"
+    assert duplicate.title == "copy"
+
+
+def test_fast_transactional_on_copy_changes_only_the_copy():
+    document = Document("draft", "body")
+    document.publish("first")
+    duplicate = copy.copy(document)
+    duplicate.publish("second")
+    assert (document.title, duplicate.title) == ("first", "second")
+    assert "publish" not in duplicate.__dict__
+
+
+def test_fast_transactional_rolls_back_copy():
+    duplicate = copy.copy(Document("draft", "body"))
+    with pytest.raises(ValueError):
+        duplicate.publish("")
+    assert (duplicate.title, duplicate.body) == ("draft", "body")
+
+
+def test_rollback_restores_only_written_attributes():
+    document = Document("draft", "body")
+    transaction = Transaction(False, document)
+    document.title = "final"
+    document.__dict__["body"] = "untracked"
+    transaction.rollback()
+    assert document.__dict__ == {"title": "draft", "body": "untracked"}
+
+
+def test_rollback_deletes_attributes_added_after_snapshot():
+    document = Document("draft", "body")
+    transaction = Transaction(False, document)
+    document.author = "me"
+    transaction.rollback()
+    assert not hasattr(document, "author")
+
+
+def test_nested_transactions_roll_back_to_their_own_snapshot():
+    document = Document("a", "body")
+    outer = Transaction(False, document)
+    document.title = "b"
+    inner = Transaction(False, document)
+    document.title = "c"
+    inner.rollback()
+    assert document.title == "b"
+    outer.rollback()
+    assert document.title == "a"
+
+
+def test_rollback_is_recorded_by_other_open_transactions():
+    document = Document("a", "body")
+    first = Transaction(False, document)
+    document.title = "b"
+    second = Transaction(False, document)
+    first.rollback()
+    assert document.title == "a"
+    second.rollback()
+    assert document.title == "b"
+
+
+def test_logs_of_dropped_transactions_are_pruned():
+    document = Document("draft", "body")
+    transaction = Transaction(False, document)
+    Transaction(False, document)
+    document.title = "final"
+    assert len(_write_logs[id(document)]) == 1
+    transaction.rollback()
+    assert document.title == "draft"
+
+
+def test_fast_transactional_keeps_log_of_open_transaction():
+    document = Document("a", "b")
+    transaction = Transaction(False, document)
+    document.publish("x")
+    document.author = "me"
+    transaction.rollback()
+    assert not hasattr(document, "author")
+    assert (document.title, document.body) == ("a", "b")
@@ -1,8 +1,18 @@
+import asyncio
+import gc
+import threading
 from unittest.mock import Mock, patch
 
 import pytest
 
-from patterns.behavioral.observer import Data, DecimalViewer, HexViewer
+from patterns.behavioral.observer import (
+    AsyncioNotificationExecutor,
+    Data,
+    DecimalViewer,
+    HexViewer,
+    InlineExecutor,
+    ThreadPoolNotificationExecutor,
+)
 
 
 @pytest.fixture
@@ -22,8 +32,11 @@ def test_attach_detach(observable):
 
 
 def test_one_data_change_notifies_each_observer_once(observable):
-    observable.attach(DecimalViewer())
-    observable.attach(HexViewer())
+    # オブザーバーは弱参照で保持されるので、参照を残しておく
+    decimal_viewer = DecimalViewer()
+    hex_viewer = HexViewer()
+    observable.attach(decimal_viewer)
+    observable.attach(hex_viewer)
 
     with patch(
         "patterns.behavioral.observer.DecimalViewer.update", new_callable=Mock()
@@ -31,3 +44,164 @@ def test_one_data_change_notifies_each_observer_once(observable):
         assert mocked_update.call_count == 0
         observable.data = 10
         assert mocked_update.call_count == 1
+
+
+def test_batch_notifies_each_observer_once_with_final_state(observable):
+    observer = Mock(spec=["update"])
+    observable.attach(observer)
+    with observable.batch():
+        for value in range(100):
+            observable.data = value
+        assert observer.update.call_count == 0
+    observer.update.assert_called_once_with(observable)
+    assert observable.data == 99
+
+
+def test_batch_passes_change_list_to_batch_observers(observable):
+    observer = Mock(spec=["update", "update_batch"])
+    observable.attach(observer)
+    with observable.batch():
+        observable.data = 1
+        observable.data = 2
+    observer.update_batch.assert_called_once_with(observable, [1, 2])
+    assert observer.update.call_count == 0
+
+
+def test_batch_passes_none_as_a_change(observable):
+    observer = Mock(spec=["update", "update_batch"])
+    observable.attach(observer)
+    with observable.batch():
+        observable.notify(change=None)
+    observer.update_batch.assert_called_once_with(observable, [None])
+
+
+def test_batch_without_changes_calls_update(observable):
+    observer = Mock(spec=["update", "update_batch"])
+    observable.attach(observer)
+    with observable.batch():
+        observable.notify()
+    observer.update.assert_called_once_with(observable)
+    assert observer.update_batch.call_count == 0
+
+
+def test_coalesced_notifications_wait_for_flush(observable):
+    observer = Mock(spec=["update"])
+    observable.attach(observer)
+    observable.coalesce = True
+    observable.data = 1
+    observable.data = 2
+    assert observer.update.call_count == 0
+    observable.flush()
+    observable.flush()
+    assert observer.update.call_count == 1
+
+
+def test_observers_are_held_weakly(observable):
+    decimal_viewer = DecimalViewer()
+    observable.attach(decimal_viewer)
+    observable.attach(decimal_viewer.update)
+    assert len(observable._observers) == 2
+
+    del decimal_viewer
+    gc.collect()
+    assert len(observable._observers) == 0
+
+
+def test_plain_callables_are_called_directly(observable):
+    calls = []
+
+    def on_change(subject):
+        calls.append(subject.data)
+
+    class Callback:
+        def __call__(self, subject):
+            calls.append(-subject.data)
+
+    callback = Callback()
+    observable.attach(on_change)
+    observable.attach(callback)
+    observable.data = 3
+    assert calls == [3, -3]
+
+
+def test_attach_is_idempotent_and_keeps_order(observable):
+    calls = []
+
+    class Recorder:
+        def __init__(self, name):
+            self.name = name
+
+        def update(self, subject):
+            calls.append(self.name)
+
+    recorders = [Recorder(name) for name in "abc"]
+    for recorder in recorders + recorders:
+        observable.attach(recorder)
+    observable.detach(recorders[1])
+    observable.data = 1
+    assert calls == ["a", "c"]
+
+
+def test_inline_executor_isolates_observer_errors(observable):
+    broken = Mock(spec=["update"])
+    broken.update.side_effect = RuntimeError("broken")
+    healthy = Mock(spec=["update"])
+    observable.attach(broken)
+    observable.attach(healthy)
+    observable.executor = InlineExecutor()
+
+    observable.data = 1
+
+    healthy.update.assert_called_once_with(observable)
+    errors = [result.error for result in observable.executor.results]
+    assert isinstance(errors[0], RuntimeError)
+    assert errors[1] is None
+    assert all(result.elapsed >= 0 for result in observable.executor.results)
+
+
+def test_thread_pool_executor_does_not_block_the_setter(observable):
+    release = threading.Event()
+
+    class SlowViewer:
+        def update(self, subject):
+            release.wait()
+
+    slow_viewer = SlowViewer()
+    observable.attach(slow_viewer)
+    observable.executor = ThreadPoolNotificationExecutor(max_workers=1)
+
+    observable.data = 1
+    assert observable.data == 1
+    release.set()
+    observable.executor.shutdown()
+    assert [result.observer for result in observable.executor.results] == [slow_viewer]
+
+
+def test_asyncio_executor_runs_coroutine_observers(observable):
+    received = []
+
+    class AsyncViewer:
+        async def update(self, subject):
+            await asyncio.sleep(0)
+            received.append(subject.data)
+
+    async def scenario():
+        async_viewer = AsyncViewer()
+        observable.attach(async_viewer)
+        observable.executor = AsyncioNotificationExecutor()
+        observable.data = 1
+        observable.data = 2
+        await observable.executor.wait()
+
+    asyncio.run(scenario())
+    assert received == [2, 2]
+
+
+def test_notify_async_collects_errors(observable):
+    broken = Mock(spec=["update"])
+    broken.update.side_effect = RuntimeError("broken")
+    observable.attach(broken)
+
+    results = asyncio.run(observable.notify_async())
+
+    assert [type(result.error) for result in results] == [RuntimeError]
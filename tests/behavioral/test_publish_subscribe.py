@@ -1,7 +1,17 @@
+import os
+import tempfile
+import threading
+import time
 import unittest
 from unittest.mock import call, patch
 
-from patterns.behavioral.publish_subscribe import Provider, Publisher, Subscriber
+from patterns.behavioral.publish_subscribe import (
+    Dispatcher,
+    MessageLog,
+    Provider,
+    Publisher,
+    Subscriber,
+)
 
 
 class TestProvider(unittest.TestCase):
@@ -66,3 +76,231 @@ class TestProvider(unittest.TestCase):
             mock_subscriber1_run.assert_has_calls(expected_sub1_calls)
             expected_sub2_calls = [call("sub 2 msg 1"), call("sub 2 msg 2")]
             mock_subscriber2_run.assert_has_calls(expected_sub2_calls)
+
+    def test_wildcard_subscriptions_shall_receive_matching_topics(cls):
+        pro = Provider()
+        pub = Publisher(pro)
+        single = Subscriber("single level", pro)
+        single.subscribe("sports.*")
+        multi = Subscriber("multi level", pro)
+        multi.subscribe("sports.#")
+        for topic in ("sports", "sports.tennis", "sports.tennis.final", "news"):
+            pub.publish(topic)
+        with patch.object(single, "run") as mock_single_run, patch.object(
+            multi, "run"
+        ) as mock_multi_run:
+            pro.update()
+            cls.assertEqual(mock_single_run.call_args_list, [call("sports.tennis")])
+            cls.assertEqual(
+                mock_multi_run.call_args_list,
+                [call("sports"), call("sports.tennis"), call("sports.tennis.final")],
+            )
+
+    def test_multi_level_wildcard_shall_match_in_any_position(cls):
+        pro = Provider()
+        pub = Publisher(pro)
+        leading = Subscriber("leading", pro)
+        leading.subscribe("#.error")
+        middle = Subscriber("middle", pro)
+        middle.subscribe("sports.#.final")
+        for topic in (
+            "error",
+            "db.error",
+            "db.primary.error",
+            "db.warning",
+            "sports.final",
+            "sports.tennis.men.final",
+            "sports.tennis",
+        ):
+            pub.publish(topic)
+        with patch.object(leading, "run") as mock_leading_run, patch.object(
+            middle, "run"
+        ) as mock_middle_run:
+            pro.update()
+            cls.assertEqual(
+                mock_leading_run.call_args_list,
+                [call("error"), call("db.error"), call("db.primary.error")],
+            )
+            cls.assertEqual(
+                mock_middle_run.call_args_list,
+                [call("sports.final"), call("sports.tennis.men.final")],
+            )
+
+    def test_unsubscribed_wildcard_shall_not_receive_topics(cls):
+        pro = Provider()
+        pub = Publisher(pro)
+        sub = Subscriber("sub name", pro)
+        sub.subscribe("sports.#")
+        sub.unsubscribe("sports.#")
+        pub.publish("sports.tennis")
+        with patch.object(sub, "run") as mock_subscriber_run:
+            pro.update()
+            cls.assertEqual(mock_subscriber_run.call_count, 0)
+
+
+class RecordingSubscriber(Subscriber):
+    def __init__(self, name, msg_center, gate=None):
+        super().__init__(name, msg_center)
+        self.received = []
+        self.gate = gate
+
+    def run(self, msg):
+        if self.gate is not None:
+            self.gate.wait()
+        self.received.append(msg)
+
+
+class BatchRecordingSubscriber(Subscriber):
+    def __init__(self, name, msg_center):
+        super().__init__(name, msg_center)
+        self.batches = []
+
+    def run_batch(self, msgs):
+        self.batches.append(msgs)
+
+
+class TestDispatcher(unittest.TestCase):
+    def test_messages_keep_their_order_per_subscriber(self):
+        dispatcher = Dispatcher(max_workers=4, queue_size=10)
+        subs = [RecordingSubscriber(f"sub {i}", Provider()) for i in range(4)]
+        for start in range(0, 500, 50):
+            for sub in subs:
+                dispatcher.submit(sub, range(start, start + 50))
+        dispatcher.shutdown()
+        for sub in subs:
+            self.assertEqual(sub.received, list(range(500)))
+
+    def test_slow_subscriber_does_not_block_others(self):
+        gate = threading.Event()
+        dispatcher = Dispatcher(max_workers=2)
+        pro = Provider(dispatcher)
+        slow = RecordingSubscriber("slow", pro, gate)
+        slow.subscribe("topic")
+        fast = BatchRecordingSubscriber("fast", pro)
+        fast.subscribe("topic")
+        Publisher(pro).publish("topic")
+        pro.update()
+        deadline = time.monotonic() + 5
+        while not fast.batches and time.monotonic() < deadline:
+            time.sleep(0.001)
+        self.assertEqual(fast.batches, [["topic"]])
+        self.assertEqual(slow.received, [])
+        gate.set()
+        dispatcher.shutdown()
+        self.assertEqual(slow.received, ["topic"])
+
+    def test_drop_policies_bound_the_queue(self):
+        for overflow, expected in (
+            ("drop_oldest", ["msg 3", "msg 4"]),
+            ("drop_newest", ["msg 0", "msg 1"]),
+        ):
+            gate = threading.Event()
+            dispatcher = Dispatcher(max_workers=1, queue_size=2, overflow=overflow)
+            blocker = RecordingSubscriber("blocker", Provider(), gate)
+            dispatcher.submit(blocker, ["first"])
+            sub = BatchRecordingSubscriber("sub", Provider())
+            dispatcher.submit(sub, [f"msg {i}" for i in range(5)])
+            gate.set()
+            dispatcher.shutdown()
+            self.assertEqual(sub.batches, [expected])
+            self.assertEqual(dispatcher.dropped, 3)
+
+    def test_subscriber_errors_are_isolated(self):
+        dispatcher = Dispatcher()
+        pro = Provider(dispatcher)
+        sub = RecordingSubscriber("sub", pro)
+        sub.subscribe("topic")
+        error = ValueError("broken")
+        with patch.object(sub, "run", side_effect=[error, None]) as mock_run:
+            Publisher(pro).publish("topic")
+            Publisher(pro).publish("topic")
+            pro.update()
+            dispatcher.shutdown()
+        self.assertEqual(mock_run.call_count, 2)
+        self.assertEqual(list(dispatcher.errors), [(sub, error)])
+
+
+class TestMessageLog(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_records_are_read_back_across_segments(self):
+        log = MessageLog(self.directory.name, segment_bytes=16)
+        for i in range(10):
+            self.assertEqual(log.append(f"msg {i}"), i)
+        self.assertGreater(len(os.listdir(self.directory.name)), 1)
+        records = [(offset, str(view, "utf-8")) for offset, view in log.read(7)]
+        self.assertEqual(records, [(7, "msg 7"), (8, "msg 8"), (9, "msg 9")])
+        log.close()
+
+    def test_reads_return_memoryviews(self):
+        log = MessageLog(self.directory.name)
+        log.append("payload")
+        ((_, view),) = log.read()
+        self.assertIsInstance(view, memoryview)
+        self.assertEqual(view.tobytes(), b"payload")
+        log.close()
+
+    def test_incomplete_record_is_discarded_on_reopen(self):
+        log = MessageLog(self.directory.name)
+        log.append("complete")
+        log._file.write(b"\x00\x00\x00\x10torn")
+        log.close()
+        reopened = MessageLog(self.directory.name)
+        self.assertEqual(reopened.end, 1)
+        reopened.append("next")
+        self.assertEqual(
+            [str(view, "utf-8") for _, view in reopened.read()], ["complete", "next"]
+        )
+        reopened.close()
+
+    def test_messages_survive_restart_before_update(self):
+        pro = Provider(log=MessageLog(self.directory.name))
+        Subscriber("sub name", pro).subscribe("topic")
+        Publisher(pro).publish("topic")
+        pro.log.close()
+
+        restarted = Provider(log=MessageLog(self.directory.name))
+        sub = Subscriber("sub name", restarted)
+        sub.subscribe("topic")
+        with patch.object(sub, "run") as mock_subscriber_run:
+            restarted.update()
+            restarted.update()
+            mock_subscriber_run.assert_called_once_with("topic")
+        restarted.log.close()
+
+    def test_late_subscriber_only_gets_new_messages_unless_replayed(self):
+        pro = Provider(log=MessageLog(self.directory.name))
+        pub = Publisher(pro)
+        pub.publish("topic")
+        late = Subscriber("late", pro)
+        late.subscribe("topic")
+        pub.publish("topic")
+        pub.publish("other")
+        with patch.object(late, "run") as mock_subscriber_run:
+            pro.update()
+            self.assertEqual(mock_subscriber_run.call_count, 1)
+            pro.replay(late)
+            self.assertEqual(mock_subscriber_run.call_count, 3)
+        pro.log.close()
+
+    def test_duplicate_subscriber_names_are_rejected(self):
+        pro = Provider(log=MessageLog(self.directory.name))
+        first = Subscriber("same", pro)
+        first.subscribe("topic")
+        first.subscribe("other")
+        Publisher(pro).publish("topic")
+        with self.assertRaises(ValueError):
+            Subscriber("same", pro).subscribe("topic")
+        with patch.object(first, "run") as mock_subscriber_run:
+            pro.update()
+            mock_subscriber_run.assert_called_once_with("topic")
+        pro.log.close()
+
+    def test_non_str_messages_are_rejected(self):
+        pro = Provider(log=MessageLog(self.directory.name))
+        with self.assertRaises(TypeError):
+            pro.notify(b"topic")
+        self.assertEqual(pro.log.end, 0)
+        pro.log.close()
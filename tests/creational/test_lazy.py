@@ -1,6 +1,16 @@
+import asyncio
+import threading
+import time
 import unittest
 
-from patterns.creational.lazy_evaluation import Person
+from patterns.creational.lazy_evaluation import (
+    Person,
+    Rectangle,
+    async_lazy_property,
+    lazy_attribute,
+    lazy_property,
+    lazy_property2,
+)
 
 
 class TestDynamicExpanding(unittest.TestCase):
@@ -36,3 +46,231 @@ class TestDynamicExpanding(unittest.TestCase):
         for _ in range(2):
             self.assertEqual(self.John.parents, "Father and mother")
         self.assertEqual(self.John.call_count2, 1)
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        class Slow:
+            def __init__(self):
+                self.calls = 0
+
+            @lazy_property
+            def value(self):
+                self.calls += 1
+                time.sleep(0.05)
+                return "value"
+
+            @lazy_property2
+            def value2(self):
+                self.calls += 1
+                time.sleep(0.05)
+                return "value2"
+
+        self.obj = Slow()
+
+    def _read_concurrently(self, name, n=8):
+        barrier = threading.Barrier(n)
+        results = []
+
+        def read():
+            barrier.wait()
+            results.append(getattr(self.obj, name))
+
+        threads = [threading.Thread(target=read) for _ in range(n)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_lazy_property_computes_once(self):
+        self.assertEqual(self._read_concurrently("value"), ["value"] * 8)
+        self.assertEqual(self.obj.calls, 1)
+        self.assertEqual(self.obj.__dict__, {"calls": 1, "value": "value"})
+
+    def test_lazy_property2_computes_once(self):
+        self.assertEqual(self._read_concurrently("value2"), ["value2"] * 8)
+        self.assertEqual(self.obj.calls, 1)
+
+    def test_locks_are_dropped(self):
+        self.obj.value
+        self.assertEqual(type(self.obj).__dict__["value"]._flight._locks, {})
+
+    def test_error_is_not_cached(self):
+        class Flaky:
+            attempts = 0
+
+            @lazy_property
+            def value(self):
+                Flaky.attempts += 1
+                if Flaky.attempts == 1:
+                    raise ValueError
+                return "ok"
+
+        obj = Flaky()
+        with self.assertRaises(ValueError):
+            obj.value
+        self.assertEqual(obj.value, "ok")
+        self.assertEqual(type(obj).__dict__["value"]._flight._locks, {})
+
+    def test_error_is_not_chained_to_lookup(self):
+        class Broken:
+            @lazy_property
+            def value(self):
+                raise ValueError
+
+        with self.assertRaises(ValueError) as cm:
+            Broken().value
+        self.assertIsNone(cm.exception.__context__)
+
+
+class TestAsyncLazyProperty(unittest.TestCase):
+    def _make(self, cache_errors=True):
+        class Remote:
+            def __init__(self):
+                self.calls = 0
+
+            @async_lazy_property(cache_errors=cache_errors)
+            async def value(self):
+                self.calls += 1
+                await asyncio.sleep(0.01)
+                if self.calls == 1:
+                    raise ConnectionError
+                return "value"
+
+            @async_lazy_property
+            async def other(self):
+                self.calls += 1
+                await asyncio.sleep(0.01)
+                return "other"
+
+        return Remote()
+
+    def test_shared_task(self):
+        obj = self._make()
+
+        async def run():
+            first = await asyncio.gather(*(obj.other for _ in range(10)))
+            return first, await obj.other
+
+        self.assertEqual(asyncio.run(run()), (["other"] * 10, "other"))
+        self.assertEqual(obj.calls, 1)
+
+    def test_errors_are_cached(self):
+        obj = self._make()
+
+        async def run():
+            for _ in range(2):
+                with self.assertRaises(ConnectionError):
+                    await obj.value
+
+        asyncio.run(run())
+        self.assertEqual(obj.calls, 1)
+
+    def test_errors_are_retried(self):
+        obj = self._make(cache_errors=False)
+
+        async def run():
+            with self.assertRaises(ConnectionError):
+                await obj.value
+            return await obj.value
+
+        self.assertEqual(asyncio.run(run()), "value")
+        self.assertEqual(obj.calls, 2)
+
+    def test_access_outside_event_loop_is_not_cached(self):
+        obj = self._make()
+        with self.assertRaises(RuntimeError):
+            obj.other
+        self.assertNotIn("other", obj.__dict__)
+
+        async def run():
+            return await obj.other
+
+        self.assertEqual(asyncio.run(run()), "other")
+        self.assertEqual(obj.calls, 1)
+
+    def test_caller_timeout_does_not_cancel_shared_task(self):
+        obj = self._make()
+
+        async def run():
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(obj.other, 0.001)
+            return await obj.other
+
+        self.assertEqual(asyncio.run(run()), "other")
+        self.assertEqual(obj.calls, 1)
+
+    def test_cancellation_is_never_cached(self):
+        obj = self._make()
+
+        async def run():
+            obj.other
+            task = obj.__dict__["other"]
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            await asyncio.sleep(0)
+            self.assertNotIn("other", obj.__dict__)
+            return await obj.other
+
+        self.assertEqual(asyncio.run(run()), "other")
+
+    def test_works_with_lazy_property(self):
+        self.assertEqual(asyncio.run(self._async_friends()), "Some friends.")
+
+    async def _async_friends(self):
+        person = Person("John", "Coder")
+        self.assertEqual(person.relatives, "Many relatives.")
+        return await person.friends
+
+
+class TestLazyAttribute(unittest.TestCase):
+    def test_slots(self):
+        rect = Rectangle(2, 3)
+        self.assertFalse(hasattr(rect, "__dict__"))
+        self.assertEqual((rect.area, rect.area, rect.call_count), (6, 6, 1))
+
+    def test_dependency_change(self):
+        rect = Rectangle(2, 3)
+        self.assertEqual(rect.area, 6)
+        rect.height = 4
+        self.assertEqual((rect.area, rect.area, rect.call_count), (8, 8, 2))
+
+    def test_invalidate(self):
+        rect = Rectangle(2, 3)
+        Rectangle.area.invalidate(rect)
+        self.assertEqual(rect.area, 6)
+        Rectangle.area.invalidate(rect)
+        self.assertEqual((rect.area, rect.call_count), (6, 2))
+
+    def test_ttl(self):
+        now = [0.0]
+
+        class Config:
+            loads = 0
+
+            @lazy_attribute(ttl=10, clock=lambda: now[0])
+            def settings(self):
+                Config.loads += 1
+                return {"loads": Config.loads}
+
+        config = Config()
+        self.assertEqual(config.settings, {"loads": 1})
+        now[0] = 9.9
+        self.assertEqual(config.settings, {"loads": 1})
+        now[0] = 10
+        self.assertEqual(config.settings, {"loads": 2})
+        self.assertIn("_lazy__settings", config.__dict__)
+
+    def test_custom_storage(self):
+        class Node:
+            __slots__ = ("_cache",)
+
+            @lazy_attribute(storage="_cache")
+            def label(self):
+                return "node"
+
+        node = Node()
+        self.assertEqual(node.label, "node")
+        self.assertEqual(node._cache[0], "node")
@@ -1,7 +1,18 @@
+import asyncio
+import gc
 import queue
+import threading
+import time
 import unittest
+import warnings
+from unittest.mock import Mock
 
-from patterns.creational.pool import ObjectPool
+from patterns.creational.pool import (
+    AsyncObjectPool,
+    BoundedObjectPool,
+    ObjectPool,
+    PoolStats,
+)
 
 
 class TestPool(unittest.TestCase):
@@ -44,8 +55,239 @@ class TestNaitivePool(unittest.TestCase):
         self.assertTrue(sample_queue.get() == "yam")
         self.assertTrue(sample_queue.empty())
 
+    def test_item_is_returned_when_lease_is_collected_in_a_cycle(self):
+        sample_queue = queue.Queue()
+        sample_queue.put("yam")
+        pool = ObjectPool(sample_queue, True)
+        pool.cycle = pool
+        del pool
+        gc.collect()
+        self.assertEqual(sample_queue.get_nowait(), "yam")
+
+    def test_leaked_lease_reports_where_it_was_acquired(self):
+        sample_queue = queue.Queue()
+        sample_queue.put("yam")
+
+        def leak():
+            ObjectPool(sample_queue, True, track_leaks=True)
+
+        with self.assertWarns(ResourceWarning) as caught:
+            leak()
+        self.assertIn("in leak", str(caught.warning))
+        self.assertEqual(sample_queue.get_nowait(), "yam")
+
+    def test_released_lease_is_not_reported(self):
+        sample_queue = queue.Queue()
+        sample_queue.put("yam")
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            with ObjectPool(sample_queue, track_leaks=True):
+                pass
+            gc.collect()
+        self.assertEqual(sample_queue.qsize(), 1)
+
     # sample_queue.put('sam')
     # test_object(sample_queue)
     # print('Outside func: {}'.format(sample_queue.get()))
 
     # if not sample_queue.empty():
+
+
+class TestBoundedObjectPool(unittest.TestCase):
+    def test_prewarms_min_size_objects(self):
+        factory = Mock(side_effect=object)
+        pool = BoundedObjectPool(factory, min_size=3)
+        self.assertEqual(factory.call_count, 3)
+        self.assertEqual(pool.idle, 3)
+
+    def test_reuses_released_objects(self):
+        pool = BoundedObjectPool(object, max_size=1)
+        with pool.checkout() as first:
+            pass
+        with pool.checkout() as second:
+            self.assertIs(first, second)
+
+    def test_acquire_times_out_when_exhausted(self):
+        pool = BoundedObjectPool(object, max_size=1)
+        pool.acquire()
+        with self.assertRaises(TimeoutError):
+            pool.acquire(timeout=0.01)
+
+    def test_invalid_objects_are_replaced(self):
+        pool = BoundedObjectPool(list, min_size=1, validate=lambda item: not item)
+        with pool.checkout() as item:
+            item.append("broken")
+        with pool.checkout() as replacement:
+            self.assertEqual(replacement, [])
+        self.assertEqual(pool.size, 1)
+
+    def test_factory_error_frees_the_slot(self):
+        def factory():
+            raise ConnectionError
+
+        pool = BoundedObjectPool(factory, max_size=1)
+        with self.assertRaises(ConnectionError):
+            pool.acquire()
+        self.assertEqual(pool.size, 0)
+
+    def test_validate_error_frees_the_slot(self):
+        validate = Mock(side_effect=[ConnectionError, True])
+        disposed = []
+        pool = BoundedObjectPool(
+            object, min_size=1, max_size=1, validate=validate, dispose=disposed.append
+        )
+        with self.assertRaises(ConnectionError):
+            pool.acquire(timeout=0.01)
+        self.assertEqual((pool.size, len(disposed)), (0, 1))
+        pool.release(pool.acquire(timeout=0.01))
+        self.assertIsNotNone(pool.acquire(timeout=0.01))
+
+    def test_evicts_objects_idle_for_too_long(self):
+        disposed = []
+        pool = BoundedObjectPool(
+            object, min_size=1, max_idle_time=60, dispose=disposed.append
+        )
+        first, second = pool.acquire(), pool.acquire()
+        pool.release(first)
+        pool.release(second)
+        pool.max_idle_time = 0
+        pool.evict_idle()
+        self.assertEqual(pool.size, 1)
+        self.assertEqual(disposed, [first])
+        pool.close()
+
+    def test_reaper_thread_evicts_in_background(self):
+        pool = BoundedObjectPool(object, max_idle_time=0.01)
+        pool.release(pool.acquire())
+        deadline = time.monotonic() + 5
+        while pool.size and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(pool.size, 0)
+        pool.close()
+
+    def test_non_positive_max_idle_time_is_rejected(self):
+        for max_idle_time in (0, -1):
+            with self.assertRaises(ValueError):
+                BoundedObjectPool(object, max_idle_time=max_idle_time)
+
+    def test_stats_record_usage(self):
+        stats = PoolStats()
+        pool = BoundedObjectPool(object, min_size=1, max_size=2, stats=stats)
+        with pool.checkout(), pool.checkout():
+            self.assertEqual(stats.snapshot()["in_use"], 2)
+            with self.assertRaises(TimeoutError):
+                pool.acquire(timeout=0)
+        snapshot = stats.snapshot()
+        self.assertEqual(snapshot["created"], 2)
+        self.assertEqual(snapshot["timeouts"], 1)
+        self.assertEqual(snapshot["in_use"], 0)
+        self.assertEqual(snapshot["peak_in_use"], 2)
+        self.assertEqual(sum(snapshot["wait_time"].values()), 2)
+        self.assertEqual(sum(snapshot["hold_time"].values()), 2)
+
+    def test_stats_are_disabled_by_default(self):
+        pool = BoundedObjectPool(object)
+        with pool.checkout():
+            pass
+        self.assertIsNone(pool.stats)
+
+    def test_never_exceeds_max_size_under_contention(self):
+        pool = BoundedObjectPool(object, max_size=4)
+        in_use = set()
+        peak = []
+        lock = threading.Lock()
+
+        def worker():
+            for _ in range(200):
+                with pool.checkout() as item:
+                    with lock:
+                        self.assertNotIn(id(item), in_use)
+                        in_use.add(id(item))
+                        peak.append(len(in_use))
+                    with lock:
+                        in_use.discard(id(item))
+
+        threads = [threading.Thread(target=worker) for _ in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLessEqual(pool.size, 4)
+        self.assertLessEqual(max(peak), 4)
+
+
+async def new_object():
+    return object()
+
+
+class TestAsyncObjectPool(unittest.TestCase):
+    def test_reuses_released_objects(self):
+        async def scenario():
+            pool = AsyncObjectPool(new_object, max_size=1)
+            async with pool.checkout() as first:
+                pass
+            async with pool.checkout() as second:
+                return first is second
+
+        self.assertTrue(asyncio.run(scenario()))
+
+    def test_waiters_are_served_in_fifo_order(self):
+        async def scenario():
+            pool = AsyncObjectPool(new_object, max_size=1)
+            order = []
+            item = await pool.acquire()
+
+            async def waiter(name):
+                async with pool.checkout():
+                    order.append(name)
+
+            tasks = [asyncio.create_task(waiter(name)) for name in "abc"]
+            await asyncio.sleep(0)
+            pool.release(item)
+            await asyncio.gather(*tasks)
+            return order
+
+        self.assertEqual(asyncio.run(scenario()), ["a", "b", "c"])
+
+    def test_acquire_times_out_when_exhausted(self):
+        async def scenario():
+            pool = AsyncObjectPool(new_object, max_size=1)
+            await pool.acquire()
+            await pool.acquire(timeout=0.01)
+
+        with self.assertRaises(TimeoutError):
+            asyncio.run(scenario())
+
+    def test_cancelled_waiter_does_not_lose_the_object(self):
+        async def scenario():
+            pool = AsyncObjectPool(new_object, max_size=1)
+            item = await pool.acquire()
+            task = asyncio.create_task(pool.acquire())
+            await asyncio.sleep(0)
+            # 待機者にオブジェクトが渡された直後にキャンセルする
+            pool.release(item)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            return pool.idle, pool.size
+
+        self.assertEqual(asyncio.run(scenario()), (1, 1))
+
+    def test_never_exceeds_max_size_with_many_coroutines(self):
+        async def scenario():
+            pool = AsyncObjectPool(new_object, max_size=4)
+            in_use = set()
+            peak = 0
+
+            async def worker():
+                nonlocal peak
+                async with pool.checkout() as item:
+                    in_use.add(id(item))
+                    peak = max(peak, len(in_use))
+                    await asyncio.sleep(0)
+                    in_use.discard(id(item))
+
+            await asyncio.gather(*(worker() for _ in range(1000)))
+            return peak, pool.size
+
+        self.assertEqual(asyncio.run(scenario()), (4, 4))